@@ -1,10 +1,145 @@
 # app/config.py
+from typing import List, Optional
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+
+class ModelRoute(BaseModel):
+    """Model dan parameter untuk satu jenis tugas AI. None = default provider."""
+    models: List[str] = []  # empty: use ai_text_models / ai_vision_models
+    max_tokens: Optional[int] = None
+    temperature: Optional[float] = None
+    timeout_seconds: Optional[float] = None  # read timeout; None: http_read_timeout
+    # "json_object" or "json_schema" if the route's models support response_format
+    response_format: Optional[str] = None
+
+
 class Settings(BaseSettings):
     openrouter_api_key: str
     openrouter_base_url: str = "https://openrouter.ai/api/v1"
-    database_file: str = "recipe_ai.db" 
+    database_file: str = "recipe_ai.db"
+    db_max_workers: int = 4  # threads for blocking SQLite work
+
+    # SQLite tuning: "production" applies the pragmas below, "default" keeps SQLite defaults
+    db_profile: str = "production"
+    db_journal_mode: str = "WAL"
+    db_synchronous: str = "NORMAL"
+    db_mmap_size: int = 256 * 1024 * 1024  # bytes
+    db_cache_size_kib: int = 64 * 1024
+    db_busy_timeout_ms: int = 5000
+    db_pool_size: int = 8
+    db_max_overflow: int = 8
+    db_pool_timeout: float = 30.0
+
+    # Sessions expire after this much inactivity (0 = never); a background
+    # reaper deletes expired sessions in batches and compacts the database
+    session_ttl_seconds: int = 7 * 24 * 60 * 60
+    session_reaper_interval_seconds: int = 10 * 60
+    session_reaper_batch_size: int = 500
+    # VACUUM at most this often (0 = never), and only once this share of pages is free
+    db_vacuum_interval_seconds: int = 24 * 60 * 60
+    db_vacuum_min_free_ratio: float = 0.25
+
+    # Write-behind for chat messages: buffer inserts and commit them together
+    # every message_flush_interval_ms or once message_flush_batch_size are queued
+    message_write_behind_enabled: bool = False
+    message_flush_interval_ms: int = 50
+    message_flush_batch_size: int = 100
+
+    # Hot-session cache (per process): selected recipe, summary and recent
+    # messages of active sessions, written through so chat turns skip DB reads.
+    # Only enable with a single worker or session-sticky routing.
+    session_cache_enabled: bool = False
+    session_cache_max_entries: int = 1024
+    session_cache_ttl_seconds: int = 15 * 60  # idle time before eviction
+    session_cache_max_messages: int = 50  # per session
+
+    # Shared HTTP client for OpenRouter (opened/closed in the app lifespan)
+    http_max_connections: int = 100
+    http_max_keepalive_connections: int = 20
+    http_keepalive_expiry: float = 30.0
+    http2_enabled: bool = False  # requires the 'h2' package
+    http_connect_timeout: float = 10.0
+    http_read_timeout: float = 120.0
+    http_write_timeout: float = 30.0
+    http_pool_timeout: float = 10.0
+
+    # Upstream AI concurrency: calls beyond ai_max_in_flight wait in a priority
+    # queue (chat before new sessions); a full queue is shed with 503 + Retry-After
+    ai_max_in_flight: int = 16
+    ai_max_queue: int = 64
+    ai_queue_timeout_seconds: float = 15.0
+    ai_retry_after_seconds: int = 5
+
+    # Ordered model fallback chains (env values are JSON lists). Text-only work
+    # uses ai_text_models; requests carrying an image use ai_vision_models.
+    ai_text_models: List[str] = ["openbmb/internvl-chat-v1.5"]
+    ai_vision_models: List[str] = ["openbmb/internvl-chat-v1.5"]
+    # Per-task routing (env values are JSON objects, e.g.
+    # AI_ROUTE_GENERATE_RECIPES='{"models": ["vendor/small-text-model"], "max_tokens": 3000}')
+    ai_route_extract_text: ModelRoute = ModelRoute(max_tokens=512, temperature=0.0)
+    ai_route_extract_image: ModelRoute = ModelRoute(max_tokens=512, temperature=0.0)
+    ai_route_generate_recipes: ModelRoute = ModelRoute()
+    ai_route_answer_question: ModelRoute = ModelRoute()
+    ai_route_summarize_history: ModelRoute = ModelRoute(temperature=0.0)
+    # Per-model retries with jittered exponential backoff on 429/5xx/timeouts
+    ai_max_retries: int = 2
+    ai_retry_base_delay_seconds: float = 0.5
+    ai_retry_max_delay_seconds: float = 8.0
+    # Chat only: send a duplicate request if no answer after this delay (0 = off)
+    ai_hedge_delay_seconds: float = 0.0
+
+    # Generate recipes as N parallel single-recipe completions (with style hints);
+    # whatever finishes within the deadline is returned
+    recipe_fanout_enabled: bool = False
+    recipe_fanout_count: int = 3
+    recipe_fanout_deadline_seconds: float = 45.0
+
+    # Ingredient extraction cache: "memory", "sqlite" (persisted in database_file) or "off"
+    extraction_cache_backend: str = "memory"
+    extraction_cache_ttl_seconds: int = 24 * 60 * 60
+    extraction_cache_max_entries: int = 2048
+
+    # Recipe generation cache keyed by canonical ingredient set + language
+    recipe_cache_backend: str = "memory"
+    recipe_cache_ttl_seconds: int = 60 * 60
+    recipe_cache_max_entries: int = 1024
+
+    # Image upload preprocessing
+    image_executor: str = "process"  # "process" or "thread"
+    image_workers: int = 2
+    image_max_upload_bytes: int = 15 * 1024 * 1024
+    image_max_pixels: int = 50_000_000  # decompression bomb guard
+    image_max_side: int = 1024
+    image_jpeg_quality: int = 85
+
+    # Reuse extraction results for near-duplicate photos (dHash Hamming distance)
+    image_phash_enabled: bool = True
+    image_phash_max_distance: int = 6  # out of 64 bits
+    image_phash_max_entries: int = 1024
+    image_phash_ttl_seconds: int = 60 * 60
+
+    # Rate limiting: "memory" (per process) or "sqlite" (shared by all workers)
+    rate_limit_backend: str = "memory"
+    rate_limit_session_requests: int = 5
+    rate_limit_session_window_seconds: int = 60
+    rate_limit_chat_requests: int = 5
+    rate_limit_chat_window_seconds: int = 60
+    rate_limit_sweep_interval_seconds: int = 60
+    # Number of reverse proxies in front of the app whose X-Forwarded-For is trusted
+    trusted_proxy_hops: int = 0
+
+    # Chat history window sent to the model (0 disables a limit)
+    chat_history_max_turns: int = 10
+    chat_history_token_budget: int = 3000
+    chat_history_tokenizer: str = "chars"  # see history_service.TOKEN_ESTIMATORS
+    # Fold messages that leave the window into a rolling summary (extra AI call)
+    chat_summary_enabled: bool = False
+
+    # Observability: Prometheus text metrics on GET /metrics, and optionally
+    # per-stage timings in a Server-Timing response header
+    metrics_enabled: bool = True
+    server_timing_enabled: bool = False
 
     model_config = SettingsConfigDict(
         env_file=".env",
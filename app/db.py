@@ -1,4 +1,13 @@
 # app/db.py
+import asyncio
+import functools
+import json
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+from uuid import uuid4
+from sqlalchemy import bindparam, event, insert, inspect, text
+from sqlalchemy.pool import QueuePool
 from sqlmodel import SQLModel, create_engine, Session
 from app.config import Settings
 
@@ -8,13 +17,150 @@ DATABASE_URL = f"sqlite:///{settings.database_file}"
 
 engine = create_engine(
     DATABASE_URL, 
-    connect_args={"check_same_thread": False}
+    connect_args={"check_same_thread": False},
+    poolclass=QueuePool,
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    pool_timeout=settings.db_pool_timeout,
 )
 
+def _profile_pragmas(profile: str) -> Dict[str, Any]:
+    """PRAGMA yang diterapkan ke setiap koneksi SQLite baru sesuai profil DB."""
+    if profile == "default":
+        return {}
+    if profile == "production":
+        return {
+            "journal_mode": settings.db_journal_mode,
+            "synchronous": settings.db_synchronous,
+            "mmap_size": settings.db_mmap_size,
+            # Negative cache_size is in KiB rather than pages
+            "cache_size": -settings.db_cache_size_kib,
+            "busy_timeout": settings.db_busy_timeout_ms,
+            "temp_store": "MEMORY",
+        }
+    raise ValueError(f"Profil DB tidak dikenal: {profile!r}")
+
+_PRAGMAS = _profile_pragmas(settings.db_profile)
+
+@event.listens_for(engine, "connect")
+def _apply_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in _PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+# Bounded thread pool for blocking DB work, so commits never run on the event loop
+_db_executor: Optional[ThreadPoolExecutor] = None
+
+def _get_db_executor() -> ThreadPoolExecutor:
+    global _db_executor
+    if _db_executor is None:
+        _db_executor = ThreadPoolExecutor(
+            max_workers=settings.db_max_workers,
+            thread_name_prefix="db",
+        )
+    return _db_executor
+
+async def run_in_db(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Menjalankan fungsi DB yang blocking di thread pool khusus database."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_db_executor(), functools.partial(fn, *args, **kwargs))
+
+def shutdown_db_executor():
+    """Menunggu pekerjaan DB yang tersisa selesai, lalu menutup thread pool."""
+    global _db_executor
+    if _db_executor is not None:
+        _db_executor.shutdown(wait=True)
+        _db_executor = None
+
 def init_db():
-    from app.models import SessionModel, MessageModel
+    from app.models import SessionModel, RecipeModel, MessageModel, CacheEntryModel, RateLimitBucketModel
     SQLModel.metadata.create_all(engine)
+    _add_missing_columns()
+    _migrate_recipes_json()
+    # create_all() only adds indexes for newly created tables; make sure
+    # indexes added later (e.g. message (session_id, timestamp)) exist too.
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+def _add_missing_columns():
+    """
+    Migrasi ringan: create_all() tidak mengubah tabel yang sudah ada, jadi
+    kolom nullable baru pada model ditambahkan dengan ALTER TABLE.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}'))
+
+_MIGRATION_BATCH_SIZE = 500
+
+def _migrate_recipes_json():
+    """
+    Migrasi resep dari kolom lama sessionmodel.recipes_json (satu blob JSON
+    per sesi) ke tabel recipemodel. Berjalan per batch, urut id (keyset, jadi
+    setiap baris dibaca sekali), dan idempoten: kolom lama di-NULL-kan setelah
+    dipindahkan. Setelah selesai kolomnya di-DROP jika SQLite mendukungnya
+    (3.35+), sehingga startup berikutnya tidak perlu scan lagi.
+    """
+    from app.models import RecipeModel
+    columns = {c["name"] for c in inspect(engine).get_columns("sessionmodel")}
+    if "recipes_json" not in columns:
+        return
+
+    last_id = ""
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                text(
+                    "SELECT id, recipes_json FROM sessionmodel"
+                    " WHERE id > :last_id AND recipes_json IS NOT NULL ORDER BY id LIMIT :limit"
+                ),
+                {"last_id": last_id, "limit": _MIGRATION_BATCH_SIZE},
+            ).all()
+            if not rows:
+                break
+            for session_id, raw in rows:
+                recipes = json.loads(raw) if isinstance(raw, str) else raw
+                for position, recipe in enumerate(recipes or []):
+                    data = {k: v for k, v in recipe.items() if k != "id"}
+                    conn.execute(
+                        insert(RecipeModel.__table__).prefix_with("OR IGNORE").values(
+                            id=recipe.get("id") or uuid4().hex,
+                            session_id=session_id,
+                            position=position,
+                            data=data,
+                        )
+                    )
+            conn.execute(
+                text("UPDATE sessionmodel SET recipes_json = NULL WHERE id IN :ids").bindparams(
+                    bindparam("ids", expanding=True)
+                ),
+                {"ids": [session_id for session_id, _ in rows]},
+            )
+        last_id = rows[-1][0]
+
+    if engine.dialect.server_version_info >= (3, 35, 0):
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE sessionmodel DROP COLUMN recipes_json"))
+
+@asynccontextmanager
+async def db_session() -> AsyncIterator[Session]:
+    """Membuka Session DB; penutupan koneksi juga dijalankan di thread pool DB."""
+    session = Session(engine)
+    try:
+        yield session
+    finally:
+        await run_in_db(session.close)
 
-def get_db():
-    with Session(engine) as session:
+async def get_db():
+    async with db_session() as session:
         yield session
@@ -1,40 +1,67 @@
 # app/deps.py
 
-import time
+from typing import Callable
 from fastapi import Depends, Request, HTTPException, status
 from sqlmodel import Session as DbSession
+from app.config import Settings
 from app.db import get_db
 from app.services.context_service import ContextService
+from app.services.metrics import rate_limit_rejections
+from app.services.rate_limiter import build_rate_limit_backend, retry_after_header
+
+settings = Settings()
 
 ## -- existing dependency untuk ContextService --
-def get_context_service(
+async def get_context_service(
     db: DbSession = Depends(get_db)
 ) -> ContextService:
     return ContextService(db)
 
 
-## -- NEW: in‐memory rate limiter dependency -- 
-# Simple store: IP → list of request timestamps
-_rate_limit_store: dict[str, list[float]] = {}
-_RATE_LIMIT = 5      # max 5 requests
-_WINDOW = 60         # per 60 detik
-
-async def rate_limit(request: Request):
-    ip = request.client.host or "unknown"
-    now = time.time()
-    # get new timestamps
-    timestamps = _rate_limit_store.get(ip, [])
-    # purge timestamps > window
-    window_start = now - _WINDOW
-    timestamps = [ts for ts in timestamps if ts > window_start]
-
-    if len(timestamps) >= _RATE_LIMIT:
-        # max limit
-        raise HTTPException(
-            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-            detail="Too Many Requests"
+## -- rate limiter dependency --
+# Sliding-window counter per (route, client IP); see app/services/rate_limiter.py
+rate_limit_backend = build_rate_limit_backend(
+    settings.rate_limit_backend,
+    settings.rate_limit_sweep_interval_seconds,
+)
+
+# route scope -> (max requests, window in seconds)
+_ROUTE_LIMITS = {
+    "session": (settings.rate_limit_session_requests, settings.rate_limit_session_window_seconds),
+    "chat": (settings.rate_limit_chat_requests, settings.rate_limit_chat_window_seconds),
+}
+
+
+def client_ip(request: Request) -> str:
+    """
+    IP klien asli. X-Forwarded-For hanya dipercaya sebanyak trusted_proxy_hops:
+    entri paling kanan ditambahkan oleh proxy kita sendiri, sedangkan entri
+    yang lebih kiri bisa dipalsukan oleh klien.
+    """
+    hops = settings.trusted_proxy_hops
+    forwarded_for = request.headers.get("x-forwarded-for")
+    if hops > 0 and forwarded_for:
+        addresses = [a.strip() for a in forwarded_for.split(",") if a.strip()]
+        if addresses:
+            return addresses[-hops] if len(addresses) >= hops else addresses[0]
+    return request.client.host if request.client else "unknown"
+
+
+def rate_limit(scope: str) -> Callable:
+    """Membuat dependency rate limit untuk satu grup route (lihat _ROUTE_LIMITS)."""
+    limit, window = _ROUTE_LIMITS[scope]
+
+    async def _rate_limit(request: Request):
+        allowed, retry_after = await rate_limit_backend.hit(
+            f"{scope}:{client_ip(request)}", limit, window
         )
+        if not allowed:
+            # max limit
+            rate_limit_rejections.inc(scope=scope)
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too Many Requests",
+                headers={"Retry-After": retry_after_header(retry_after)},
+            )
 
-    # write this requests
-    timestamps.append(now)
-    _rate_limit_store[ip] = timestamps
+    return _rate_limit
@@ -3,8 +3,14 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.config import Settings
-from app.db import init_db
+from app.db import init_db, shutdown_db_executor
+from app.services.ai_service import ai_client
+from app.services.context_service import message_writer
+from app.services.image_service import UploadSizeLimitMiddleware, image_service
+from app.services.maintenance import session_reaper
+from app.services.metrics import ServerTimingMiddleware
 from app.routers.cooking_session import router as cooking_router
+from app.routers.metrics import router as metrics_router
 
 settings = Settings()
 
@@ -19,8 +25,25 @@ app = FastAPI(
 
 # Initialize SQLite database when application starts
 @app.on_event("startup")
-def on_startup():
+async def on_startup():
     init_db()
+    # Open the shared, pooled HTTP client used for all OpenRouter calls
+    await ai_client.startup()
+    # Periodically delete expired sessions and compact the database
+    session_reaper.start()
+    # Batch chat message inserts into fewer commits
+    if settings.message_write_behind_enabled:
+        message_writer.start()
+
+# Close pooled connections when application stops
+@app.on_event("shutdown")
+async def on_shutdown():
+    await session_reaper.stop()
+    await ai_client.shutdown()
+    image_service.shutdown()
+    # Persist buffered chat messages before the DB threads go away
+    await message_writer.stop()
+    shutdown_db_executor()
 
 # CORS (Cross-Origin Resource Sharing) configuration
 app.add_middleware(
@@ -33,11 +56,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Reject oversized image uploads before the multipart body is read
+app.add_middleware(UploadSizeLimitMiddleware)
+
+# Per-stage timings in the Server-Timing header (visible in browser devtools)
+if settings.server_timing_enabled:
+    app.add_middleware(ServerTimingMiddleware)
+
 # CHANGE: Register the integrated router under /api prefix
 # All endpoints from cooking_session.py will be available under /api
 # Example: /api/session/ , /api/session/{context_id}/chat
 app.include_router(cooking_router, prefix="/api")
 
+# Prometheus scrape endpoint, outside /api
+if settings.metrics_enabled:
+    app.include_router(metrics_router)
+
 
 @app.get("/", tags=["Root"], summary="Cek Status API")
 async def read_root():
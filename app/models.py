@@ -3,21 +3,49 @@ from typing import Optional, List
 from datetime import datetime
 from uuid import uuid4
 from sqlmodel import SQLModel, Field, Relationship, Column
-from sqlalchemy import JSON
+from sqlalchemy import JSON, ForeignKey, Index, String
 
 class SessionModel(SQLModel, table=True):
     id: str = Field(default_factory=lambda: uuid4().hex, primary_key=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
-    selected_recipe_id: Optional[str] = None
-
-    recipes_json: List[dict] = Field(
-        sa_column=Column(JSON), default=[]
+    # Pushed forward on activity; NULL (pre-TTL rows) falls back to created_at
+    expires_at: Optional[datetime] = Field(default=None, index=True)
+    # use_alter: recipemodel also references this table (rendered inline on SQLite)
+    selected_recipe_id: Optional[str] = Field(
+        default=None,
+        sa_column=Column(String, ForeignKey("recipemodel.id", use_alter=True), nullable=True),
     )
+    # Chat system prompt rendered once for the selected recipe (compact format)
+    chat_system_prompt: Optional[str] = None
+
+    # Rolling summary of chat messages that fell out of the history window,
+    # and the id of the last message already folded into it.
+    history_summary: Optional[str] = None
+    summary_upto_message_id: Optional[int] = None
 
     messages: List["MessageModel"] = Relationship(back_populates="session")
 
 
+class RecipeModel(SQLModel, table=True):
+    """Satu resep hasil AI dalam sebuah sesi; dimuat per resep, bukan per sesi."""
+    __table_args__ = (
+        Index("ix_recipemodel_session_id_position", "session_id", "position"),
+    )
+
+    id: str = Field(primary_key=True)
+    session_id: str = Field(foreign_key="sessionmodel.id")
+    # Order in which the recipes were generated
+    position: int = 0
+    # Recipe fields as returned by the AI, without "id"
+    data: dict = Field(sa_column=Column(JSON, nullable=False))
+
+
 class MessageModel(SQLModel, table=True):
+    # Chat history lookups and session cleanup filter by session and sort by time
+    __table_args__ = (
+        Index("ix_messagemodel_session_id_timestamp", "session_id", "timestamp"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     session_id: str = Field(foreign_key="sessionmodel.id")
     role: str
@@ -25,3 +53,21 @@ class MessageModel(SQLModel, table=True):
     timestamp: datetime = Field(default_factory=datetime.utcnow)
 
     session: SessionModel = Relationship(back_populates="messages")
+
+
+class CacheEntryModel(SQLModel, table=True):
+    """Entri cache hasil AI yang persisten (dipakai oleh SQLiteCacheBackend)."""
+    namespace: str = Field(primary_key=True)
+    key: str = Field(primary_key=True)
+    value: str
+    expires_at: float = Field(index=True)
+    last_access: float = Field(index=True)
+
+
+class RateLimitBucketModel(SQLModel, table=True):
+    """State sliding-window rate limiter yang dibagi antar worker (backend 'sqlite')."""
+    key: str = Field(primary_key=True)
+    window_index: int = 0
+    current: int = 0
+    previous: int = 0
+    expires_at: float = Field(default=0, index=True)
@@ -140,4 +140,78 @@ ATURAN PALING KETAT (WAJIB DIIKUTI):
 
 KONTEKS RESEP:
 {recipe_context}
-"""
\ No newline at end of file
+"""
+
+
+# ==============================================================================
+# PROMPT #4: ROLLING CHAT HISTORY SUMMARY
+# Older messages that no longer fit in the history window are folded into
+# a short summary, which is sent alongside the recent messages.
+# ==============================================================================
+
+CHAT_HISTORY_SUMMARY_PROMPT = """\
+SYSTEM:
+You maintain a running summary of a cooking conversation between a user and "Chef AI Cooking Companion".
+
+INSTRUCTIONS:
+1.  You receive the PREVIOUS SUMMARY (may be empty) and NEW MESSAGES.
+2.  Return an updated summary that merges both, in the same language as the conversation.
+3.  Keep only facts useful for continuing the conversation: the user's questions, preferences, substitutions, problems, and Chef AI's key answers.
+4.  Maximum 120 words. Output ONLY the summary text, no heading or explanation.
+"""
+
+CHAT_SUMMARY_CONTEXT_EN = """\
+SUMMARY OF EARLIER CONVERSATION:
+{summary}
+"""
+
+CHAT_SUMMARY_CONTEXT_ID = """\
+RINGKASAN PERCAKAPAN SEBELUMNYA:
+{summary}
+"""
+
+
+# ==============================================================================
+# PROMPT #5: STRUCTURED JSON OUTPUT
+# JSON mode (response_format) needs an object at the root, so the array
+# from the prompts above is wrapped under a single key.
+# ==============================================================================
+
+JSON_OBJECT_OUTPUT_HINT = """
+JSON MODE: wrap the array in a JSON object under the key "{key}", e.g. {{"{key}": [...]}}.
+"""
+
+
+# ==============================================================================
+# PROMPT #6: PARALLEL RECIPE FAN-OUT
+# Appended to the recipe prompt when recipes are generated one per request.
+# The style hints keep the parallel requests from producing the same dish.
+# ==============================================================================
+
+RECIPE_FANOUT_HINT_EN = """
+OVERRIDE FOR THIS REQUEST: create ONLY ONE recipe (recipe {index} of {count}), still as a JSON array with a single recipe object.
+Style for this recipe: {style}.
+The other recipes are being created separately in these styles: {other_styles}. Make this one clearly different from them.
+"""
+
+RECIPE_FANOUT_HINT_ID = """
+PENGECUALIAN UNTUK PERMINTAAN INI: buat HANYA SATU resep (resep ke-{index} dari {count}), tetap sebagai array JSON berisi satu objek resep.
+Gaya resep ini: {style}.
+Resep lainnya dibuat terpisah dengan gaya: {other_styles}. Pastikan resep ini jelas berbeda dari resep-resep tersebut.
+"""
+
+RECIPE_FANOUT_STYLES_EN = [
+    "a quick everyday dish (stir-fry or pan-fried)",
+    "a comforting soup, stew or braise",
+    "a baked, roasted or grilled dish",
+    "a light dish such as a salad or snack",
+    "a rice or noodle one-bowl meal",
+]
+
+RECIPE_FANOUT_STYLES_ID = [
+    "masakan cepat sehari-hari (tumis atau goreng)",
+    "masakan berkuah seperti sup, soto atau semur",
+    "masakan panggang, bakar atau oven",
+    "hidangan ringan seperti salad atau camilan",
+    "hidangan nasi atau mi dalam satu mangkuk",
+]
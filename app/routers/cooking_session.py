@@ -1,4 +1,6 @@
 # app/routers/cooking_session.py
+import json
+import httpx
 from fastapi import (
     APIRouter,
     Depends,
@@ -8,9 +10,8 @@ from fastapi import (
     Form,
     status, 
 )
-from typing import Optional
-from io import BytesIO
-from PIL import Image
+from fastapi.responses import StreamingResponse
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple
 from app.schemas import (
     GenerateRecipesResponse,
     SelectRecipeRequest,
@@ -19,6 +20,7 @@ from app.schemas import (
 )
 from app.services.recipe_service import recipe_service
 from app.services.context_service import ContextService
+from app.services.image_service import ProcessedImage, image_service
 from app.deps import get_context_service, rate_limit
 
 # Create a router with prefixes and tags for better API documentation
@@ -34,7 +36,7 @@ router = APIRouter(
     status_code=status.HTTP_201_CREATED,
     summary="Memulai Sesi Memasak Baru",
     description="Kirim teks atau gambar bahan untuk mendapatkan daftar resep dan memulai sesi baru.",
-    dependencies=[Depends(rate_limit)],
+    dependencies=[Depends(rate_limit("session"))],
 )
 async def start_new_session(
     context_service: ContextService = Depends(get_context_service),
@@ -45,6 +47,49 @@ async def start_new_session(
     Endpoint untuk memulai sesi. Menerima input bahan (teks/gambar),
     menghasilkan resep, dan mengembalikan context_id untuk interaksi selanjutnya.
     """
+    processed_image = await _preprocess_session_input(text, image)
+
+    context_id, recipes = await recipe_service.handle_initial_request(
+        context_service=context_service, text=text, image=processed_image
+    )
+    
+    return GenerateRecipesResponse(context_id=context_id, recipes=recipes)
+
+
+@router.post(
+    "/stream",
+    summary="Memulai Sesi Memasak Baru (Streaming)",
+    description=(
+        "Sama seperti endpoint mulai sesi, tetapi hasilnya dikirim bertahap sebagai "
+        "Server-Sent Events: `event: session` dengan `context_id` dan `ingredients`, "
+        "lalu `event: recipe` untuk setiap resep begitu selesai dibuat, diakhiri "
+        "`event: done` (atau `event: error` jika AI gagal)."
+    ),
+    response_class=StreamingResponse,
+    dependencies=[Depends(rate_limit("session"))],
+)
+async def start_new_session_stream(
+    context_service: ContextService = Depends(get_context_service),
+    text: Optional[str] = Form(None),
+    image: Optional[UploadFile] = File(None),
+):
+    """
+    Mengirim context_id dan bahan segera setelah ekstraksi, lalu setiap resep
+    segera setelah objek JSON-nya lengkap, tanpa menunggu seluruh resep.
+    """
+    processed_image = await _preprocess_session_input(text, image)
+    events = await recipe_service.handle_initial_request_stream(
+        context_service=context_service, text=text, image=processed_image
+    )
+    return StreamingResponse(
+        _sse_events(events, _named_event, "Gagal memproses respons resep dari AI"),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _preprocess_session_input(text: Optional[str], image: Optional[UploadFile]) -> Optional[ProcessedImage]:
+    """Validasi input form sesi baru dan preprocessing gambar (jika ada)."""
     if not text and not image:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -52,29 +97,14 @@ async def start_new_session(
         )
 
     # Processing Image
-    if image:
-        # Validation content type
-        if not image.content_type.startswith("image/"):
-            raise HTTPException(status_code=400, detail="File yang diunggah bukan gambar.")
-        try:
-            raw_content = await image.read()
-            # Resize and compression for efisiensi
-            processed_image = Image.open(BytesIO(raw_content)).convert("RGB")
-            processed_image.thumbnail((1024, 1024)) # Max 1024px
-            
-            buffer = BytesIO()
-            processed_image.save(buffer, format="JPEG", quality=85)
-            buffer.seek(0)
-            
-            image = UploadFile(file=buffer, filename=image.filename, media_type="image/jpeg")
-        except Exception:
-            raise HTTPException(status_code=400, detail="Gagal memproses file gambar.")
-
-    context_id, recipes = await recipe_service.handle_initial_request(
-        context_service=context_service, text=text, image=image
-    )
-    
-    return GenerateRecipesResponse(context_id=context_id, recipes=recipes)
+    if not image:
+        return None
+    # Validation content type
+    if not image.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="File yang diunggah bukan gambar.")
+    # Resize, compression and perceptual hash, off the event loop.
+    # The processed JPEG bytes go straight to the AI layer.
+    return await image_service.preprocess_upload(image)
 
 
 @router.post(
@@ -83,7 +113,7 @@ async def start_new_session(
     summary="Memilih Resep",
     description="Setelah resep dibuat, endpoint ini digunakan untuk memilih salah satu resep yang akan dibahas.",
 )
-def select_a_recipe(
+async def select_a_recipe(
     context_id: str,
     request: SelectRecipeRequest,
     context_service: ContextService = Depends(get_context_service),
@@ -92,7 +122,7 @@ def select_a_recipe(
     Menandai resep yang dipilih pengguna berdasarkan context_id dan recipe_id.
     """
     try:
-        recipe_service.select_recipe(
+        await recipe_service.select_recipe(
             context_service=context_service,
             context_id=context_id,
             recipe_id=request.recipe_id,
@@ -106,7 +136,7 @@ def select_a_recipe(
     response_model=ChatResponse,
     summary="Mengirim Pesan Chat ke AI",
     description="Berinteraksi dengan Chef AI mengenai resep yang telah dipilih.",
-    dependencies=[Depends(rate_limit)],
+    dependencies=[Depends(rate_limit("chat"))],
 )
 async def chat_with_assistant(
     context_id: str,
@@ -128,13 +158,78 @@ async def chat_with_assistant(
         raise HTTPException(status_code=status_code, detail=detail)
 
 
+@router.post(
+    "/{context_id}/chat/stream",
+    summary="Mengirim Pesan Chat ke AI (Streaming)",
+    description=(
+        "Sama seperti endpoint chat, tetapi balasan dikirim bertahap sebagai "
+        "Server-Sent Events: `data: {\"delta\": \"...\"}` untuk tiap potongan teks, "
+        "diakhiri `event: done` (atau `event: error` jika AI gagal)."
+    ),
+    response_class=StreamingResponse,
+    dependencies=[Depends(rate_limit("chat"))],
+)
+async def chat_with_assistant_stream(
+    context_id: str,
+    request: ChatRequest,
+    context_service: ContextService = Depends(get_context_service),
+):
+    """
+    Mengalirkan balasan AI token demi token agar pengguna langsung melihat jawaban.
+    Balasan lengkap disimpan ke riwayat setelah stream selesai.
+    """
+    try:
+        deltas = await recipe_service.handle_chat_message_stream(
+            context_service=context_service, context_id=context_id, message=request.message
+        )
+    except KeyError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+
+    return StreamingResponse(
+        _sse_events(deltas, _delta_event, "Gagal memproses respons dari AI"),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _delta_event(delta: str) -> str:
+    return f"data: {json.dumps({'delta': delta}, ensure_ascii=False)}\n\n"
+
+
+def _named_event(event: Tuple[str, Dict[str, Any]]) -> str:
+    name, data = event
+    return f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _sse_events(
+    events: AsyncIterator[Any],
+    format_event: Callable[[Any], str],
+    error_prefix: str
+) -> AsyncIterator[str]:
+    """Membungkus event dari service ke format Server-Sent Events, diakhiri done atau error."""
+    try:
+        async for event in events:
+            yield format_event(event)
+    except HTTPException as e:
+        # e.g. the upstream queue wait timed out after the stream had started
+        payload = {"detail": e.detail}
+        yield f"event: error\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+        return
+    except (httpx.HTTPError, ValueError) as e:
+        # Headers are already sent, so report upstream failures in-band.
+        payload = {"detail": f"{error_prefix}: {e}"}
+        yield f"event: error\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+        return
+    yield "event: done\ndata: {}\n\n"
+
+
 @router.delete(
     "/{context_id}",
     status_code=status.HTTP_204_NO_CONTENT,
     summary="Mengakhiri Sesi Memasak",
     description="Menghapus sesi dan semua riwayat percakapan dari database.",
 )
-def end_a_session(
+async def end_a_session(
     context_id: str,
     context_service: ContextService = Depends(get_context_service),
 ):
@@ -142,4 +237,4 @@ def end_a_session(
     Membersihkan data sesi setelah pengguna selesai.
     Menggunakan metode HTTP DELETE yang lebih sesuai secara semantik.
     """
-    recipe_service.end_session(context_service, context_id)
\ No newline at end of file
+    await recipe_service.end_session(context_service, context_id)
\ No newline at end of file
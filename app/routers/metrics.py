@@ -0,0 +1,77 @@
+# app/routers/metrics.py
+from typing import Iterable, List, Tuple
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from app.config import Settings
+from app.deps import rate_limit_backend
+from app.services.ai_service import ai_client
+from app.services.context_service import message_writer
+from app.services.metrics import Sample, metrics
+from app.services.rate_limiter import MemoryRateLimitBackend
+from app.services.session_cache import session_cache
+
+settings = Settings()
+
+router = APIRouter(tags=["Metrics"])
+
+
+def _collect_state() -> Iterable[Tuple[str, str, str, List[Sample]]]:
+    """Nilai yang sudah dilacak masing-masing service, dibaca saat scrape."""
+    hit_caches = {
+        "extract_ingredients": ai_client.extraction_cache,
+        "generate_recipes": ai_client.recipe_cache,
+        "image_phash": ai_client.image_hash_index,
+    }
+    caches = {name: cache.stats() for name, cache in hit_caches.items() if cache is not None}
+    session_stats = session_cache.stats() if session_cache is not None else None
+    if session_stats is not None:
+        caches["session"] = session_stats
+    yield "cache_hits_total", "counter", "Cache hit per cache.", [
+        ("", {"cache": name}, stats["hits"]) for name, stats in caches.items()
+    ]
+    yield "cache_misses_total", "counter", "Cache miss per cache.", [
+        ("", {"cache": name}, stats["misses"]) for name, stats in caches.items()
+    ]
+    yield "cache_hit_ratio", "gauge", "Rasio hit cache sejak proses dimulai.", [
+        ("", {"cache": name}, stats["hit_ratio"]) for name, stats in caches.items()
+    ]
+
+    if session_stats is not None:
+        yield "session_cache_entries", "gauge", "Sesi aktif di hot-session cache proses ini.", [
+            ("", {}, session_stats["entries"])
+        ]
+
+    admission = ai_client.admission
+    yield "upstream_in_flight", "gauge", "Panggilan AI upstream yang sedang berjalan.", [("", {}, admission.in_flight)]
+    yield "upstream_queued", "gauge", "Panggilan AI upstream yang menunggu slot.", [("", {}, admission.queued)]
+    yield "upstream_rejected_total", "counter", "Panggilan AI yang ditolak karena antrian penuh (HTTP 503).", [
+        ("", {}, admission.rejected)
+    ]
+
+    yield "coalesced_calls_in_flight", "gauge", "Panggilan AI unik yang sedang berjalan di lapisan single-flight.", [
+        ("", {}, ai_client.flights.in_flight())
+    ]
+
+    # The sqlite backend's keys live in the shared DB, not in this process
+    if isinstance(rate_limit_backend, MemoryRateLimitBackend):
+        yield "rate_limit_tracked_keys", "gauge", "Key (scope, IP) yang dilacak rate limiter di proses ini.", [
+            ("", {}, len(rate_limit_backend))
+        ]
+
+    if settings.message_write_behind_enabled:
+        yield "message_writer_backlog", "gauge", "Pesan chat yang belum ditulis ke DB.", [
+            ("", {}, message_writer.backlog)
+        ]
+
+
+metrics.register_collector(_collect_state)
+
+
+@router.get(
+    "/metrics",
+    response_class=PlainTextResponse,
+    summary="Metrik Prometheus",
+    description="Histogram durasi per tahap, token upstream, rasio hit cache, antrian dan penolakan rate limit.",
+)
+async def read_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
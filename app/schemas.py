@@ -1,7 +1,7 @@
 # app/schemas.py
 
-from pydantic import BaseModel, Field
-from typing import List, Dict, Any, Optional
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+from typing import List, Dict, Any, Optional, Union
 
 # ==============================================================================
 # Scheme for Initiation Process & Recipe Creation
@@ -41,4 +41,55 @@ class ChatResponse(BaseModel):
     """
     Respons yang dikirim ke user setelah AI membalas chat.
     """
-    reply: str = Field(..., description="Balasan dari Chef AI.")
\ No newline at end of file
+    reply: str = Field(..., description="Balasan dari Chef AI.")
+
+# ==============================================================================
+# Scheme for Structured AI Output (validation & response_format JSON schema)
+# ==============================================================================
+
+def _number_to_str(value: Any) -> Any:
+    # Models often emit quantities, times and servings as bare numbers
+    return str(value) if isinstance(value, (int, float)) else value
+
+
+class RecipeIngredient(BaseModel):
+    """
+    Satu bahan dalam resep yang dihasilkan AI.
+    """
+    model_config = ConfigDict(extra="allow")
+
+    item: str = Field(..., min_length=1)
+    quantity: Optional[str] = None
+    unit: Optional[str] = None
+
+    _number_to_str = field_validator("quantity", "unit", mode="before")(_number_to_str)
+
+
+class Recipe(BaseModel):
+    """
+    Satu resep hasil AI. Field tambahan dari model tetap disimpan.
+    """
+    model_config = ConfigDict(extra="allow")
+
+    title: str = Field(..., min_length=1)
+    description: Optional[str] = ""
+    ingredients: List[Union[RecipeIngredient, str]] = Field(..., min_length=1)
+    instructions: List[str] = Field(..., min_length=1)
+    prep_time: Optional[str] = None
+    servings: Optional[str] = None
+
+    _number_to_str = field_validator("prep_time", "servings", mode="before")(_number_to_str)
+
+
+class RecipeListOutput(BaseModel):
+    """
+    Bentuk output generate_recipes saat response_format JSON dipakai.
+    """
+    recipes: List[Recipe]
+
+
+class IngredientListOutput(BaseModel):
+    """
+    Bentuk output extract_ingredients saat response_format JSON dipakai.
+    """
+    ingredients: List[str]
@@ -0,0 +1,90 @@
+# app/services/admission.py
+
+import asyncio
+import heapq
+import itertools
+import math
+from typing import List, Tuple
+from fastapi import HTTPException, status
+
+# Lower value = served first when slots free up
+PRIORITY_CHAT = 0
+PRIORITY_SESSION = 1
+PRIORITY_BACKGROUND = 2
+
+
+class AdmissionController:
+    """
+    Membatasi jumlah panggilan AI ke upstream yang berjalan bersamaan.
+    Request yang tidak langsung mendapat slot menunggu di antrean berprioritas
+    (chat lebih dulu daripada pembuatan sesi baru) dengan batas waktu. Jika
+    antrean penuh atau waktu tunggu habis, request langsung ditolak dengan
+    503 + Retry-After alih-alih menumpuk dan memicu 429 dari upstream.
+    """
+    def __init__(self, max_in_flight: int, max_queue: int, queue_timeout: float, retry_after: int):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._in_flight = 0
+        self._queued = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self.rejected = 0
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    def ensure_capacity(self):
+        """Load shedding cepat: tolak sekarang jika antrean sudah penuh."""
+        if self._in_flight >= self.max_in_flight and self._queued >= self.max_queue:
+            raise self._overloaded("Layanan AI sedang sibuk, silakan coba lagi sebentar lagi.")
+
+    async def acquire(self, priority: int):
+        """Menunggu slot upstream. Setiap acquire() wajib diikuti release()."""
+        if self._in_flight < self.max_in_flight and self._queued == 0:
+            self._in_flight += 1
+            return
+
+        if self._queued >= self.max_queue:
+            raise self._overloaded("Layanan AI sedang sibuk, silakan coba lagi sebentar lagi.")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._queued += 1
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as we gave up: pass it on.
+                self.release()
+            else:
+                future.cancel()
+                self._queued -= 1
+            if isinstance(e, asyncio.TimeoutError):
+                raise self._overloaded("Antrean layanan AI terlalu lama, silakan coba lagi.")
+            raise
+
+    def release(self):
+        """Mengembalikan slot; langsung diserahkan ke penunggu dengan prioritas tertinggi."""
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                # Hand the slot over directly; in_flight stays the same.
+                self._queued -= 1
+                future.set_result(None)
+                return
+        self._in_flight -= 1
+
+    def _overloaded(self, detail: str) -> HTTPException:
+        self.rejected += 1
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=detail,
+            headers={"Retry-After": str(math.ceil(self.retry_after))},
+        )
@@ -1,27 +1,138 @@
 # app/services/ai_service.py
 
+import asyncio
+import copy
 import json
 import base64
-import re
+import logging
+import time
 import uuid 
-from typing import List, Optional, Dict, Any
+from contextlib import aclosing
+from typing import AsyncIterator, List, Optional, Dict, Any, Tuple, Type
 import httpx
-from fastapi import UploadFile, HTTPException
-from app.config import Settings
+from fastapi import HTTPException
+from pydantic import BaseModel, ValidationError
+from app.config import ModelRoute, Settings
 from app.prompts import (
     UNIFIED_EXTRACT_AND_VALIDATE_PROMPT,
     GENERATE_RECIPES_PROMPT_ID,
     GENERATE_RECIPES_PROMPT_EN,
     CHAT_SYSTEM_PROMPT_ID,
     CHAT_SYSTEM_PROMPT_EN,
+    CHAT_HISTORY_SUMMARY_PROMPT,
+    CHAT_SUMMARY_CONTEXT_ID,
+    CHAT_SUMMARY_CONTEXT_EN,
+    JSON_OBJECT_OUTPUT_HINT,
+    RECIPE_FANOUT_HINT_EN,
+    RECIPE_FANOUT_HINT_ID,
+    RECIPE_FANOUT_STYLES_EN,
+    RECIPE_FANOUT_STYLES_ID,
 )
+from app.schemas import IngredientListOutput, Recipe, RecipeListOutput
+from app.services.admission import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_CHAT,
+    PRIORITY_SESSION,
+    AdmissionController,
+)
+from app.services.json_stream import JsonStreamParser, extract_json
+from app.services.metrics import record_usage, stage_timer, timed, upstream_duration
+from app.services.cache_service import (
+    PerceptualHashIndex,
+    build_cache,
+    make_cache_key,
+    normalize_text,
+)
+from app.services.retry import RetryPolicy, describe_error, hedged
+from app.services.singleflight import SingleFlight
 
 settings = Settings()
+logger = logging.getLogger(__name__)
+
+# Written first on each compact ingredient line; other fields follow in parentheses
+_INGREDIENT_MAIN_KEYS = ("quantity", "unit", "item")
+
+_RECIPE_LABELS_EN = {
+    "title": "Title", "description": "Description", "prep_time": "Prep time",
+    "servings": "Servings", "ingredients": "Ingredients", "instructions": "Steps",
+}
+_RECIPE_LABELS_ID = {
+    "title": "Judul", "description": "Deskripsi", "prep_time": "Waktu persiapan",
+    "servings": "Porsi", "ingredients": "Bahan", "instructions": "Langkah",
+}
+
+
+
+class InlineImage:
+    """
+    Gambar yang disisipkan ke pesan chat sebagai data URL. Base64 baru dibuat
+    saat body request di-encode, langsung sebagai bytes dan hanya sekali.
+    """
+    def __init__(self, data: bytes, media_type: str = "image/jpeg"):
+        self.data = data
+        self.media_type = media_type
+
+
+class _RequestBody:
+    """Body JSON sebagai daftar potongan bytes; bisa diiterasi ulang (untuk retry)."""
+    def __init__(self, chunks: List[bytes]):
+        self.chunks = chunks
+        self.length = sum(len(c) for c in chunks)
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+def _encode_json_body(payload: Dict[str, Any]) -> _RequestBody:
+    """
+    Serialisasi payload ke JSON bytes. Setiap InlineImage diganti placeholder
+    saat json.dumps, lalu base64-nya disisipkan sebagai potongan bytes terpisah,
+    sehingga gambar tidak pernah menjadi str Python atau di-escape ulang oleh
+    encoder JSON (base64 tidak butuh escaping).
+    """
+    images: List[InlineImage] = []
+    marker = f"inline-image-{uuid.uuid4().hex}"
+
+    def _default(obj: Any) -> str:
+        if isinstance(obj, InlineImage):
+            images.append(obj)
+            return f"{marker}-{len(images) - 1}"
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+    encoded = json.dumps(payload, ensure_ascii=False, default=_default).encode("utf-8")
+    if not images:
+        return _RequestBody([encoded])
+
+    chunks: List[bytes] = []
+    rest = encoded
+    for index, image in enumerate(images):
+        before, rest = rest.split(f"{marker}-{index}".encode("ascii"), 1)
+        chunks += [
+            before,
+            f"data:{image.media_type};base64,".encode("ascii"),
+            base64.b64encode(image.data),
+        ]
+    chunks.append(rest)
+    return _RequestBody(chunks)
+
+
+def _with_default_models(route: ModelRoute, default_models: List[str]) -> ModelRoute:
+    return route if route.models else route.model_copy(update={"models": default_models})
+
+
+def _error_status(error: httpx.HTTPError) -> str:
+    """Label status metrik upstream: kode HTTP atau jenis error transport."""
+    if isinstance(error, httpx.HTTPStatusError):
+        return str(error.response.status_code)
+    return type(error).__name__
+
 
 class AIClient:
     """
     Klien AI yang telah direfaktor untuk efisiensi, kontrol, dan konsistensi.
-    Menggunakan satu model multimodal dan prompt yang kuat.
+    Model multimodal hanya dipakai untuk input gambar; setiap panggilan punya
+    daftar model cadangan dan retry untuk error sementara.
     """
     def __init__(self):
         self.api_key = settings.openrouter_api_key
@@ -30,45 +141,312 @@ class AIClient:
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
-        # Define a single model that we will use across all services.
-        self.model = "openbmb/internvl-chat-v1.5" 
+        # Per-task model routes. Routes without their own models use the default
+        # fallback chain; text-only work never needs the multimodal model.
+        self.routes: Dict[str, ModelRoute] = {
+            "extract_text": _with_default_models(settings.ai_route_extract_text, settings.ai_text_models),
+            "extract_image": _with_default_models(settings.ai_route_extract_image, settings.ai_vision_models),
+            "generate_recipes": _with_default_models(settings.ai_route_generate_recipes, settings.ai_text_models),
+            "answer_question": _with_default_models(settings.ai_route_answer_question, settings.ai_text_models),
+            "summarize_history": _with_default_models(settings.ai_route_summarize_history, settings.ai_text_models),
+        }
+        self.retry_policy = RetryPolicy(
+            settings.ai_max_retries,
+            settings.ai_retry_base_delay_seconds,
+            settings.ai_retry_max_delay_seconds,
+        )
+        # Shared, pooled HTTP client. Opened by startup() from the app lifespan.
+        self._client: Optional[httpx.AsyncClient] = None
+        # Content-addressed cache for extract_ingredients (None when disabled)
+        self.extraction_cache = build_cache(
+            "extract_ingredients",
+            settings.extraction_cache_backend,
+            settings.extraction_cache_max_entries,
+            settings.extraction_cache_ttl_seconds,
+        )
+        # Cache for generate_recipes, keyed by canonical ingredient set (None when disabled)
+        self.recipe_cache = build_cache(
+            "generate_recipes",
+            settings.recipe_cache_backend,
+            settings.recipe_cache_max_entries,
+            settings.recipe_cache_ttl_seconds,
+        )
+        # Near-duplicate photo lookup for extract_ingredients (None when disabled)
+        self.image_hash_index = PerceptualHashIndex(
+            settings.image_phash_max_distance,
+            settings.image_phash_max_entries,
+            settings.image_phash_ttl_seconds,
+        ) if settings.image_phash_enabled else None
+        # Coalesces identical concurrent calls (same cache key) into one upstream request
+        self.flights = SingleFlight()
+        # Caps concurrent upstream calls; shared by every completion below
+        self.admission = AdmissionController(
+            settings.ai_max_in_flight,
+            settings.ai_max_queue,
+            settings.ai_queue_timeout_seconds,
+            settings.ai_retry_after_seconds,
+        )
+
+    def _build_http_client(self) -> httpx.AsyncClient:
+        """Membuat httpx.AsyncClient dengan connection pool dan keep-alive."""
+        http2 = settings.http2_enabled
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                # HTTP/2 is optional; fall back to HTTP/1.1 keep-alive.
+                http2 = False
+
+        return httpx.AsyncClient(
+            base_url=self.base_url,
+            headers=self.headers,
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=settings.http_max_connections,
+                max_keepalive_connections=settings.http_max_keepalive_connections,
+                keepalive_expiry=settings.http_keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(
+                connect=settings.http_connect_timeout,
+                read=settings.http_read_timeout,
+                write=settings.http_write_timeout,
+                pool=settings.http_pool_timeout,
+            ),
+        )
+
+    async def startup(self):
+        """Membuka HTTP client bersama. Dipanggil saat aplikasi start."""
+        if self._client is None or self._client.is_closed:
+            self._client = self._build_http_client()
+
+    async def shutdown(self):
+        """Menutup HTTP client bersama beserta semua koneksinya."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Lazily open the client when used outside the app lifespan (e.g. scripts).
+        if self._client is None or self._client.is_closed:
+            self._client = self._build_http_client()
+        return self._client
+
+    async def _execute_chat_completion(
+        self,
+        messages: List[Dict[str, Any]],
+        route: str,
+        priority: int = PRIORITY_SESSION,
+        hedge: bool = False,
+        output_schema: Optional[Type[BaseModel]] = None
+    ) -> Dict[str, Any]:
+        """
+        Fungsi inti yang mengeksekusi panggilan ke API OpenRouter memakai
+        route tugas (model, max_tokens, temperature, timeout) yang diberikan.
+        Memakai ulang koneksi dari HTTP client bersama. Error sementara dicoba
+        ulang dengan backoff, lalu model berikutnya di daftar fallback dipakai.
+        Dengan hedge=True, request kedua dikirim jika yang pertama lambat.
+        output_schema dipakai untuk response_format jika route mengaktifkannya.
+        """
+        model_route = self.routes[route]
+        response_format = self._response_format(model_route, output_schema)
+
+        async def call() -> Dict[str, Any]:
+            response = await self._send_with_fallback(messages, route, priority, response_format=response_format)
+            data = response.json()
+            record_usage(route, data.get("usage"))
+            return data
+
+        delay = settings.ai_hedge_delay_seconds
+        # Only hedge when there is spare upstream capacity; never add to a queue
+        if hedge and delay > 0 and self.admission.queued == 0:
+            return await hedged(call, delay)
+        return await call()
 
-    async def _execute_chat_completion(self, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    async def _send_with_fallback(
+        self,
+        messages: List[Dict[str, Any]],
+        route: str,
+        priority: int,
+        stream: bool = False,
+        response_format: Optional[Dict[str, Any]] = None
+    ) -> httpx.Response:
         """
-        Fungsi inti yang mengeksekusi panggilan ke API OpenRouter.
-        Dibuat lebih robust dengan timeout yang lebih panjang.
+        Mengirim request ke setiap model secara berurutan, masing-masing dengan
+        retry, sampai ada respons sukses. Setiap percobaan mengambil slot sendiri
+        dari admission controller, sehingga jeda backoff tidak memegang slot.
+        Dengan stream=True slot tetap dipegang untuk respons yang dikembalikan;
+        pemanggil wajib menutup respons lalu memanggil admission.release().
         """
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(
-                f"{self.base_url}/chat/completions",
-                headers=self.headers,
-                json={"model": self.model, "messages": messages}
+        model_route = self.routes[route]
+        timeout = self.client.timeout
+        if model_route.timeout_seconds is not None:
+            timeout = httpx.Timeout(
+                connect=timeout.connect, read=model_route.timeout_seconds, write=timeout.write, pool=timeout.pool
             )
-        response.raise_for_status()
-        return response.json()
 
-    def _extract_json_from_response(self, text: str) -> Any:
+        error: Optional[Exception] = None
+        for model in model_route.models:
+            payload: Dict[str, Any] = {"model": model, "messages": messages}
+            if model_route.max_tokens is not None:
+                payload["max_tokens"] = model_route.max_tokens
+            if model_route.temperature is not None:
+                payload["temperature"] = model_route.temperature
+            if response_format is not None:
+                payload["response_format"] = response_format
+            if stream:
+                payload["stream"] = True
+            body = _encode_json_body(payload)
+
+            attempt = 0
+            while True:
+                await self.admission.acquire(priority)
+                started = time.perf_counter()
+                try:
+                    response = await self.client.send(
+                        self.client.build_request(
+                            "POST",
+                            "/chat/completions",
+                            content=body,
+                            headers={"Content-Length": str(body.length)},
+                            timeout=timeout,
+                        ),
+                        stream=stream,
+                    )
+                    if response.is_error:
+                        await response.aclose()
+                    response.raise_for_status()
+                except httpx.HTTPError as e:
+                    self.admission.release()
+                    error = e
+                    upstream_duration.observe(
+                        time.perf_counter() - started, route=route, model=model, status=_error_status(e)
+                    )
+                except BaseException:
+                    # Including cancellation, e.g. the losing side of a hedged request
+                    self.admission.release()
+                    raise
+                else:
+                    upstream_duration.observe(
+                        time.perf_counter() - started, route=route, model=model, status=str(response.status_code)
+                    )
+                    if not stream:
+                        self.admission.release()
+                    return response
+
+                delay = self.retry_policy.backoff(attempt, error)
+                if delay is None:
+                    break
+                logger.warning(
+                    "Upstream %s gagal (%s), mencoba lagi dalam %.1f detik", model, describe_error(error), delay
+                )
+                await asyncio.sleep(delay)
+                attempt += 1
+
+            # A missing/disabled model is as good a reason to fall back as a transient error
+            model_gone = isinstance(error, httpx.HTTPStatusError) and error.response.status_code == 404
+            if not (self.retry_policy.is_retryable(error) or model_gone) or model == model_route.models[-1]:
+                break
+            logger.warning("Model %s tidak tersedia (%s), beralih ke model cadangan", model, describe_error(error))
+        raise error
+
+    async def _stream_chat_completion(
+        self,
+        messages: List[Dict[str, Any]],
+        route: str,
+        priority: int = PRIORITY_CHAT,
+        output_schema: Optional[Type[BaseModel]] = None
+    ) -> AsyncIterator[str]:
+        """
+        Versi streaming dari _execute_chat_completion (stream=true).
+        Menghasilkan potongan teks (delta) segera setelah diterima dari OpenRouter.
+        Retry dan fallback hanya berlaku sebelum stream dimulai; slot upstream
+        dipegang sampai stream selesai.
+        """
+        model_route = self.routes[route]
+        response = await self._send_with_fallback(
+            messages,
+            route,
+            priority,
+            stream=True,
+            response_format=self._response_format(model_route, output_schema),
+        )
+        try:
+            async for line in response.aiter_lines():
+                # SSE: skip blank keep-alive lines and ": comment" lines
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                if "error" in chunk:
+                    raise ValueError(f"OpenRouter mengembalikan error saat streaming: {chunk['error']}")
+                # OpenRouter reports usage in the last chunk
+                record_usage(route, chunk.get("usage"))
+                choices = chunk.get("choices") or []
+                if not choices:
+                    continue
+                delta = (choices[0].get("delta") or {}).get("content")
+                if delta:
+                    yield delta
+        finally:
+            await response.aclose()
+            self.admission.release()
+
+    @staticmethod
+    def _response_format(route: ModelRoute, schema: Optional[Type[BaseModel]]) -> Optional[Dict[str, Any]]:
+        """Nilai response_format OpenRouter untuk route ini (None = teks biasa)."""
+        if route.response_format is None or schema is None:
+            return None
+        if route.response_format == "json_object":
+            return {"type": "json_object"}
+        if route.response_format == "json_schema":
+            return {
+                "type": "json_schema",
+                "json_schema": {"name": schema.__name__, "schema": schema.model_json_schema(), "strict": False},
+            }
+        raise ValueError(f"response_format tidak dikenal: {route.response_format!r}")
+
+    def _json_mode_messages(self, messages: List[Dict[str, Any]], route: str, key: str) -> List[Dict[str, Any]]:
+        """Di JSON mode, minta model membungkus array dalam objek {key: [...]}."""
+        if self.routes[route].response_format is None:
+            return messages
+        system = messages[0]
+        return [{**system, "content": system["content"] + JSON_OBJECT_OUTPUT_HINT.format(key=key)}, *messages[1:]]
+
+    def _extract_json_from_response(self, text: str, key: Optional[str] = None) -> Any:
         """
         Helper untuk mengekstrak blok JSON dari respons teks AI yang terkadang
-        mengandung teks tambahan sebelum atau sesudah blok JSON.
+        mengandung teks tambahan sebelum atau sesudah blok JSON. Objek JSON
+        mode ({key: [...]}) dibuka menjadi list di dalamnya.
         """
-        # Search for JSON blocks enclosed by ```json ... ``` or ``` ... ```
-        match = re.search(r"```(json)?\s*([\s\S]*?)\s*```", text)
-        if match:
-            text = match.group(2)
-        
-        # Search from the first to the last curly/square bracket
-        start = text.find('[') if text.find('[') != -1 else text.find('{')
-        end = text.rfind(']') if text.rfind(']') != -1 else text.rfind('}')
-        
-        if start != -1 and end != -1:
-            json_str = text[start : end + 1]
-            try:
-                return json.loads(json_str)
-            except json.JSONDecodeError as e:
-                raise ValueError(f"Gagal mem-parse JSON yang diekstrak: {e}\nString Asli: {json_str}")
-        
-        raise ValueError("Tidak ada blok JSON yang valid ditemukan dalam respons AI.")
+        accept = (lambda data: isinstance(self._unwrap_json(data, key), list)) if key else None
+        with stage_timer("json_parse"):
+            return self._unwrap_json(extract_json(text, accept), key)
+
+    @staticmethod
+    def _unwrap_json(data: Any, key: Optional[str]) -> Any:
+        if key and isinstance(data, dict) and isinstance(data.get(key), list):
+            return data[key]
+        return data
+
+    def _validate_recipes(self, recipes: List[Any]) -> List[Dict[str, Any]]:
+        """
+        Memvalidasi resep terhadap schema Recipe. Resep yang tidak valid dibuang
+        agar satu resep rusak tidak menggagalkan seluruh respons.
+        """
+        valid = [r for r in map(self._validate_recipe, recipes) if r is not None]
+        if recipes and not valid:
+            raise ValueError("Tidak ada resep valid dalam respons AI.")
+        return valid
+
+    def _validate_recipe(self, recipe: Any) -> Optional[Dict[str, Any]]:
+        try:
+            return Recipe.model_validate(recipe).model_dump(exclude_none=True)
+        except ValidationError as e:
+            logger.warning("Resep dari AI tidak valid, dilewati: %s", e.errors()[:3])
+            return None
 
     def _detect_indonesian(self, text: str) -> bool:
         """Deteksi bahasa sederhana untuk memilih prompt yang tepat."""
@@ -77,103 +455,445 @@ class AIClient:
 
     # --- PUBLIC FUNCTION FOR ENDPOINT ---
 
+    @timed("ai.extract_ingredients")
     async def extract_ingredients(
         self,
         text_input: Optional[str] = None,
-        image_file: Optional[UploadFile] = None
+        image_bytes: Optional[bytes] = None,
+        image_media_type: str = "image/jpeg",
+        image_hash: Optional[int] = None
     ) -> List[str]:
         """
         Fungsi terpadu untuk mengekstrak bahan dari teks atau gambar,
         menggunakan UNIFIED_EXTRACT_AND_VALIDATE_PROMPT.
+        image_bytes adalah gambar yang sudah diproses (lihat image_service) dan
+        image_hash perceptual hash-nya, untuk memakai ulang hasil foto yang hampir sama.
         """
-        if not text_input and not image_file:
+        if not text_input and not image_bytes:
             raise HTTPException(status_code=400, detail="Harus menyediakan input teks atau file gambar.")
 
+        # Same normalized text + same processed image bytes => same result
+        text_key = normalize_text(text_input)
+        cache_key = make_cache_key(text_key.encode("utf-8"), image_bytes)
+        if self.extraction_cache:
+            cached = await self.extraction_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        # Same text + a visually near-identical photo => reuse a recent result
+        use_hash_index = self.image_hash_index is not None and image_bytes and image_hash is not None
+        if use_hash_index:
+            similar = self.image_hash_index.lookup(text_key, image_hash)
+            if similar is not None:
+                return similar
+
+        ingredients = await self.flights.do(
+            f"extract:{cache_key}",
+            lambda: self._extract_ingredients_upstream(text_input, image_bytes, image_media_type, cache_key),
+        )
+        if use_hash_index:
+            self.image_hash_index.add(text_key, image_hash, ingredients)
+        return ingredients
+
+    async def _extract_ingredients_upstream(
+        self,
+        text_input: Optional[str],
+        image_bytes: Optional[bytes],
+        image_media_type: str,
+        cache_key: str
+    ) -> List[str]:
+        """Memanggil model untuk ekstraksi bahan, lalu menyimpan hasilnya ke cache."""
         user_content = []
         prompt_input_text = ""
 
         if text_input:
             prompt_input_text += f"Analisis teks berikut: '{text_input}'"
         
-        if image_file:
+        if image_bytes:
             prompt_input_text += "\nAnalisis juga gambar yang terlampir."
-            raw_content = await image_file.read()
-            b64_image = base64.b64encode(raw_content).decode('utf-8')
             user_content.append({
                 "type": "image_url",
-                "image_url": {"url": f"data:{image_file.content_type};base64,{b64_image}"}
+                "image_url": {"url": InlineImage(image_bytes, image_media_type)}
             })
         
         user_content.insert(0, {"type": "text", "text": prompt_input_text})
         
-        messages = [
+        route = "extract_image" if image_bytes else "extract_text"
+        messages = self._json_mode_messages([
             {"role": "system", "content": UNIFIED_EXTRACT_AND_VALIDATE_PROMPT},
             {"role": "user", "content": user_content}
-        ]
+        ], route, "ingredients")
         
         try:
-            response = await self._execute_chat_completion(messages)
+            response = await self._execute_chat_completion(messages, route=route, output_schema=IngredientListOutput)
             ai_response_text = response["choices"][0]["message"]["content"]
-            ingredients = self._extract_json_from_response(ai_response_text)
+            ingredients = self._extract_json_from_response(ai_response_text, key="ingredients")
             if not isinstance(ingredients, list):
                 raise ValueError("Respons JSON dari AI bukanlah sebuah list.")
-            return ingredients
         except (ValueError, json.JSONDecodeError, IndexError) as e:
             raise HTTPException(status_code=502, detail=f"Gagal memproses respons dari AI: {e}")
 
+        if self.extraction_cache:
+            await self.extraction_cache.set(cache_key, ingredients)
+        return ingredients
+
+    @timed("ai.generate_recipes")
     async def generate_recipes(self, ingredients: List[str]) -> List[Dict[str, Any]]:
         """
         Membuat resep berdasarkan daftar bahan yang valid.
         Secara otomatis menambahkan UUID yang aman pada setiap resep.
         """
+        is_id, cache_key = self._recipe_cache_key(ingredients)
+        if self.recipe_cache:
+            cached = await self.recipe_cache.get(cache_key)
+            if cached is not None:
+                return self._assign_recipe_ids(cached)
+
+        recipes = await self.flights.do(
+            f"recipes:{cache_key}",
+            lambda: self._generate_recipes_upstream(ingredients, is_id, cache_key),
+        )
+        # The result may be shared with other coalesced callers; never mutate it.
+        return self._assign_recipe_ids(copy.deepcopy(recipes))
+
+    @timed("ai.generate_recipes_stream")
+    async def generate_recipes_stream(self, ingredients: List[str]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Versi streaming dari generate_recipes: setiap resep (dengan ID) dihasilkan
+        begitu objek JSON-nya lengkap di token stream, tanpa menunggu resep lain.
+        """
+        is_id, cache_key = self._recipe_cache_key(ingredients)
+        if self.recipe_cache:
+            cached = await self.recipe_cache.get(cache_key)
+            if cached is not None:
+                for recipe in self._assign_recipe_ids(cached):
+                    yield recipe
+                return
+
+        if settings.recipe_fanout_enabled:
+            async with aclosing(self._fanout_recipes(ingredients, is_id, cache_key)) as fanout:
+                async for recipe in fanout:
+                    yield self._assign_recipe_ids([copy.deepcopy(recipe)])[0]
+            return
+
+        parser = JsonStreamParser(accept=lambda data: isinstance(self._unwrap_json(data, "recipes"), list))
+        recipes: List[Dict[str, Any]] = []
+        # aclosing: release the upstream slot promptly if the client goes away
+        async with aclosing(self._stream_chat_completion(
+            self._recipe_messages(ingredients, is_id),
+            route="generate_recipes",
+            priority=PRIORITY_SESSION,
+            output_schema=RecipeListOutput,
+        )) as deltas:
+            async for delta in deltas:
+                for item in parser.feed(delta):
+                    recipe = self._validate_recipe(item)
+                    if recipe is not None:
+                        recipes.append(recipe)
+                        yield self._assign_recipe_ids([copy.deepcopy(recipe)])[0]
+
+        if not recipes and not parser.done:
+            # No root found while streaming, e.g. an unmatched quote in the
+            # prose; rescan the complete reply like the non-streaming path
+            try:
+                late = self._extract_json_from_response(parser.text, key="recipes")
+            except ValueError:
+                late = None
+            if late == []:
+                return
+            for recipe in map(self._validate_recipe, late if isinstance(late, list) else []):
+                if recipe is not None:
+                    recipes.append(recipe)
+                    yield self._assign_recipe_ids([copy.deepcopy(recipe)])[0]
+
+        if not recipes:
+            # An empty list means the ingredients are insufficient, not an error
+            if parser.done and self._unwrap_json(parser.value(), "recipes") == []:
+                return
+            raise ValueError("Tidak ada resep valid dalam respons AI.")
+        if self.recipe_cache:
+            await self.recipe_cache.set(cache_key, recipes)
+
+    def _recipe_cache_key(self, ingredients: List[str]) -> Tuple[bool, str]:
+        """Bahasa resep dan cache key dari himpunan bahan yang sudah dinormalisasi."""
         is_id = self._detect_indonesian(" ".join(ingredients))
+
+        # Order-insensitive, case/whitespace-normalized ingredient set + language
+        canonical = sorted({normalize_text(i) for i in ingredients if normalize_text(i)})
+        cache_key = make_cache_key(
+            b"id" if is_id else b"en",
+            json.dumps(canonical, ensure_ascii=False).encode("utf-8"),
+        )
+        return is_id, cache_key
+
+    def _recipe_messages(self, ingredients: List[str], is_id: bool) -> List[Dict[str, Any]]:
         prompt_template = GENERATE_RECIPES_PROMPT_ID if is_id else GENERATE_RECIPES_PROMPT_EN
-        
-        messages = [
+        return self._json_mode_messages([
             {"role": "system", "content": prompt_template},
             {"role": "user", "content": json.dumps(ingredients)}
-        ]
+        ], "generate_recipes", "recipes")
+
+    async def _generate_recipes_upstream(
+        self,
+        ingredients: List[str],
+        is_id: bool,
+        cache_key: str
+    ) -> List[Dict[str, Any]]:
+        """Memanggil model untuk membuat resep (tanpa ID), lalu menyimpannya ke cache."""
+        if settings.recipe_fanout_enabled:
+            return [recipe async for recipe in self._fanout_recipes(ingredients, is_id, cache_key)]
+
+        messages = self._recipe_messages(ingredients, is_id)
 
         try:
-            response = await self._execute_chat_completion(messages)
+            response = await self._execute_chat_completion(
+                messages, route="generate_recipes", output_schema=RecipeListOutput
+            )
             ai_response_text = response["choices"][0]["message"]["content"]
-            recipes = self._extract_json_from_response(ai_response_text)
+            recipes = self._extract_json_from_response(ai_response_text, key="recipes")
             
             if not isinstance(recipes, list):
                 raise ValueError("Respons JSON dari AI bukanlah sebuah list resep.")
-
-            # Generate ID on server side, not asking AI.
-            for recipe in recipes:
-                recipe['id'] = str(uuid.uuid4())
-            
-            return recipes
+            recipes = self._validate_recipes(recipes)
         except (ValueError, json.JSONDecodeError, IndexError) as e:
             raise HTTPException(status_code=502, detail=f"Gagal memproses respons resep dari AI: {e}")
 
+        # Cache the recipes without IDs; every caller gets its own fresh IDs.
+        if self.recipe_cache:
+            await self.recipe_cache.set(cache_key, recipes)
+        return recipes
+
+    async def _fanout_recipes(
+        self,
+        ingredients: List[str],
+        is_id: bool,
+        cache_key: str
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Membuat resep dengan N completion paralel, masing-masing satu resep dengan
+        gaya berbeda. Resep dihasilkan sesuai urutan selesai; request yang gagal
+        dilewati dan yang belum selesai saat deadline dibatalkan. Hasil hanya
+        di-cache jika semua request berhasil.
+        """
+        count = settings.recipe_fanout_count
+        all_styles = RECIPE_FANOUT_STYLES_ID if is_id else RECIPE_FANOUT_STYLES_EN
+        styles = [all_styles[i % len(all_styles)] for i in range(count)]
+        pending = {
+            asyncio.ensure_future(self._generate_one_recipe(ingredients, is_id, i, styles))
+            for i in range(count)
+        }
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.recipe_fanout_deadline_seconds
+        recipes: List[Dict[str, Any]] = []
+        seen_titles = set()
+        failures = 0
+        try:
+            while pending:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        failures += 1
+                        logger.warning("Satu request resep paralel gagal: %s", describe_error(task.exception()))
+                        continue
+                    for recipe in task.result():
+                        # Style hints make duplicates rare, but drop exact repeats
+                        title = normalize_text(recipe.get("title"))
+                        if title in seen_titles:
+                            continue
+                        seen_titles.add(title)
+                        recipes.append(recipe)
+                        yield recipe
+        finally:
+            for task in pending:
+                task.cancel()
+
+        if not recipes:
+            if pending:
+                raise HTTPException(status_code=504, detail="Pembuatan resep melebihi batas waktu.")
+            if failures:
+                raise HTTPException(status_code=502, detail="Gagal memproses respons resep dari AI.")
+        elif pending or failures:
+            logger.warning("Resep paralel tidak lengkap: %d dari %d request", count - len(pending) - failures, count)
+        elif self.recipe_cache:
+            await self.recipe_cache.set(cache_key, recipes)
+
+    async def _generate_one_recipe(
+        self,
+        ingredients: List[str],
+        is_id: bool,
+        index: int,
+        styles: List[str]
+    ) -> List[Dict[str, Any]]:
+        """Satu request fan-out: satu resep dengan gaya styles[index]."""
+        hint_template = RECIPE_FANOUT_HINT_ID if is_id else RECIPE_FANOUT_HINT_EN
+        hint = hint_template.format(
+            index=index + 1,
+            count=len(styles),
+            style=styles[index],
+            other_styles="; ".join(s for i, s in enumerate(styles) if i != index) or "-",
+        )
+        messages = self._recipe_messages(ingredients, is_id)
+        messages[0] = {**messages[0], "content": messages[0]["content"] + hint}
+
+        response = await self._execute_chat_completion(
+            messages, route="generate_recipes", output_schema=RecipeListOutput
+        )
+        ai_response_text = response["choices"][0]["message"]["content"]
+        recipes = self._extract_json_from_response(ai_response_text, key="recipes")
+        if isinstance(recipes, dict):
+            recipes = [recipes]  # a lone recipe object instead of a one-item array
+        if not isinstance(recipes, list):
+            raise ValueError("Respons JSON dari AI bukanlah sebuah list resep.")
+        return self._validate_recipes(recipes)[:1]
+
+    def _assign_recipe_ids(self, recipes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Generate ID on server side, not asking AI. Sesi yang berbeda selalu mendapat ID berbeda."""
+        for recipe in recipes:
+            recipe['id'] = str(uuid.uuid4())
+        return recipes
+
+    @timed("ai.answer_question")
     async def answer_question(
         self,
         recipe: Dict[str, Any],
         question: str,
-        chat_history: List[Dict[str, str]]
+        chat_history: List[Dict[str, str]],
+        history_summary: Optional[str] = None,
+        system_prompt: Optional[str] = None
     ) -> str:
         """
-        Menjawab pertanyaan tentang resep secara kontekstual, dengan mempertimbangkan riwayat chat.
+        Menjawab pertanyaan tentang resep secara kontekstual, dengan mempertimbangkan riwayat chat
+        (dan ringkasan percakapan lama, jika ada). system_prompt adalah prompt yang sudah
+        dirender saat resep dipilih (lihat build_chat_system_prompt).
         """
-        is_id = self._detect_indonesian(question) or self._detect_indonesian(recipe.get('title', ''))
-        prompt_template = CHAT_SYSTEM_PROMPT_ID if is_id else CHAT_SYSTEM_PROMPT_EN
-        
-        # Create recipe context in a neat string format
-        recipe_context_str = json.dumps(recipe, indent=2, ensure_ascii=False)
-        system_prompt = prompt_template.format(recipe_context=recipe_context_str)
+        messages = self._build_chat_messages(recipe, question, chat_history, history_summary, system_prompt)
+        response = await self._execute_chat_completion(
+            messages, route="answer_question", priority=PRIORITY_CHAT, hedge=True
+        )
+        return response["choices"][0]["message"]["content"]
+
+    @timed("ai.answer_question_stream")
+    async def answer_question_stream(
+        self,
+        recipe: Dict[str, Any],
+        question: str,
+        chat_history: List[Dict[str, str]],
+        history_summary: Optional[str] = None,
+        system_prompt: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """
+        Sama seperti answer_question, tetapi mengalirkan balasan token demi token.
+        """
+        messages = self._build_chat_messages(recipe, question, chat_history, history_summary, system_prompt)
+        async with aclosing(
+            self._stream_chat_completion(messages, route="answer_question", priority=PRIORITY_CHAT)
+        ) as deltas:
+            async for delta in deltas:
+                yield delta
+
+    def _build_chat_messages(
+        self,
+        recipe: Dict[str, Any],
+        question: str,
+        chat_history: List[Dict[str, str]],
+        history_summary: Optional[str] = None,
+        system_prompt: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Menyusun system prompt, ringkasan, riwayat chat, dan pertanyaan baru untuk chat."""
+        title_is_id = self._detect_indonesian(recipe.get('title', ''))
+        is_id = self._detect_indonesian(question) or title_is_id
+
+        # The stored prompt is rendered in the recipe's language; only re-render
+        # when the question switches the conversation to Indonesian.
+        if not system_prompt or is_id != title_is_id:
+            system_prompt = self._render_chat_system_prompt(recipe, is_id)
         
-        messages = [
-            {"role": "system", "content": system_prompt},
-            *chat_history,  # Enter all previous conversation history
+        messages = [{"role": "system", "content": system_prompt}]
+        if history_summary:
+            summary_template = CHAT_SUMMARY_CONTEXT_ID if is_id else CHAT_SUMMARY_CONTEXT_EN
+            messages.append({"role": "system", "content": summary_template.format(summary=history_summary)})
+        messages += [
+            *chat_history,  # Recent conversation window (older turns are summarized)
             {"role": "user", "content": question}
         ]
+        return messages
 
-        response = await self._execute_chat_completion(messages)
-        return response["choices"][0]["message"]["content"]
+    def build_chat_system_prompt(self, recipe: Dict[str, Any]) -> str:
+        """
+        Merender system prompt chat untuk sebuah resep. Dipanggil sekali saat
+        resep dipilih, lalu disimpan dan dipakai ulang di setiap giliran chat.
+        """
+        return self._render_chat_system_prompt(recipe, self._detect_indonesian(recipe.get('title', '')))
+
+    def _render_chat_system_prompt(self, recipe: Dict[str, Any], is_id: bool) -> str:
+        prompt_template = CHAT_SYSTEM_PROMPT_ID if is_id else CHAT_SYSTEM_PROMPT_EN
+        return prompt_template.format(recipe_context=self._compact_recipe_context(recipe, is_id))
+
+    def _compact_recipe_context(self, recipe: Dict[str, Any], is_id: bool) -> str:
+        """
+        Format baris yang ringkas untuk konteks resep. Jauh lebih hemat token
+        dibanding json.dumps(recipe, indent=2): tanpa kurung, kutip, indentasi,
+        dan nama key yang berulang di setiap bahan.
+        """
+        labels = _RECIPE_LABELS_ID if is_id else _RECIPE_LABELS_EN
+        lines = []
+        for key in ("title", "description", "prep_time", "servings"):
+            if recipe.get(key):
+                lines.append(f"{labels[key]}: {recipe[key]}")
+
+        ingredients = recipe.get("ingredients") or []
+        if ingredients:
+            lines.append(f"{labels['ingredients']}:")
+            for ing in ingredients:
+                if isinstance(ing, dict):
+                    parts = [str(ing.get(k)) for k in _INGREDIENT_MAIN_KEYS if ing.get(k)]
+                    # Notes, preparation and other extra fields stay in the context
+                    extras = [
+                        f"{key}: {value}" for key, value in ing.items()
+                        if key not in _INGREDIENT_MAIN_KEYS and value not in (None, "", [], {})
+                    ]
+                    if extras:
+                        parts.append(f"({'; '.join(extras)})")
+                    lines.append("- " + " ".join(parts))
+                else:
+                    lines.append(f"- {ing}")
+
+        instructions = recipe.get("instructions") or []
+        if instructions:
+            lines.append(f"{labels['instructions']}:")
+            lines.extend(f"{i}. {step}" for i, step in enumerate(instructions, start=1))
+
+        # Keep any extra fields the model added, minified
+        for key, value in recipe.items():
+            if key not in _RECIPE_LABELS_EN and key != "id":
+                lines.append(f"{key}: {json.dumps(value, ensure_ascii=False, separators=(',', ':'))}")
+        return "\n".join(lines)
+
+    @timed("ai.summarize_history")
+    async def summarize_history(
+        self,
+        previous_summary: Optional[str],
+        messages: List[Dict[str, str]]
+    ) -> str:
+        """
+        Memperbarui ringkasan percakapan secara inkremental: ringkasan lama
+        digabung dengan pesan-pesan yang baru keluar dari window riwayat.
+        """
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+        prompt_messages = [
+            {"role": "system", "content": CHAT_HISTORY_SUMMARY_PROMPT},
+            {"role": "user", "content": (
+                f"PREVIOUS SUMMARY:\n{previous_summary or '-'}\n\nNEW MESSAGES:\n{transcript}"
+            )},
+        ]
+        response = await self._execute_chat_completion(
+            prompt_messages, route="summarize_history", priority=PRIORITY_BACKGROUND
+        )
+        return response["choices"][0]["message"]["content"].strip()
 
 
 # Singleton instance to use throughout the application
@@ -0,0 +1,203 @@
+# app/services/cache_service.py
+
+import hashlib
+import json
+import time
+from collections import deque
+from typing import Any, Deque, Optional, Tuple
+from cachetools import TTLCache
+from sqlalchemy import delete, func
+from sqlmodel import Session as DbSession, select
+from app.db import engine, run_in_db
+from app.models import CacheEntryModel
+
+
+def make_cache_key(*parts: Optional[bytes]) -> str:
+    """
+    Membuat key cache berbasis konten (SHA-256) dari beberapa potongan bytes.
+    Panjang tiap potongan ikut di-hash agar batas antar potongan tidak ambigu.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        part = part or b""
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def normalize_text(text: Optional[str]) -> str:
+    """Normalisasi teks untuk key cache: huruf kecil dan spasi dirapikan."""
+    return " ".join((text or "").split()).casefold()
+
+
+class MemoryCacheBackend:
+    """Backend in-process dengan TTL dan eviksi LRU (cachetools.TTLCache)."""
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self._cache: TTLCache = TTLCache(maxsize=max_entries, ttl=ttl_seconds)
+
+    async def get(self, key: str) -> Optional[str]:
+        return self._cache.get(key)
+
+    async def set(self, key: str, value: str):
+        self._cache[key] = value
+
+
+# LRU recency granularity of SQLiteCacheBackend; hits within it stay read-only
+_TOUCH_INTERVAL_SECONDS = 60
+
+
+class SQLiteCacheBackend:
+    """
+    Backend persisten yang disimpan di tabel CacheEntryModel pada database aplikasi.
+    Jumlah entri dibatasi dengan eviksi LRU; entri kedaluwarsa dibersihkan saat set.
+    Pembacaan hanya menulis (memperbarui last_access) jika last_access sudah
+    lebih lama dari _TOUCH_INTERVAL_SECONDS, agar cache hit tidak berebut
+    write lock SQLite dengan penulisan chat dan rate limiter.
+    """
+    def __init__(self, namespace: str, max_entries: int, ttl_seconds: int):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+    async def get(self, key: str) -> Optional[str]:
+        return await run_in_db(self._get, key)
+
+    async def set(self, key: str, value: str):
+        await run_in_db(self._set, key, value)
+
+    def _get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with DbSession(engine) as db:
+            entry = db.get(CacheEntryModel, (self.namespace, key))
+            if entry is None:
+                return None
+            if entry.expires_at <= now:
+                return None  # purged by the next _set
+            value = entry.value
+            if now - entry.last_access >= _TOUCH_INTERVAL_SECONDS:
+                entry.last_access = now
+                db.add(entry)
+                db.commit()
+            return value
+
+    def _set(self, key: str, value: str):
+        now = time.time()
+        with DbSession(engine) as db:
+            entry = db.get(CacheEntryModel, (self.namespace, key))
+            if entry is None:
+                entry = CacheEntryModel(namespace=self.namespace, key=key, value=value,
+                                        expires_at=0, last_access=0)
+            entry.value = value
+            entry.expires_at = now + self.ttl_seconds
+            entry.last_access = now
+            db.add(entry)
+
+            # Drop expired entries, then evict least recently used ones over the cap
+            db.exec(delete(CacheEntryModel).where(
+                CacheEntryModel.namespace == self.namespace,
+                CacheEntryModel.expires_at <= now,
+            ))
+            db.flush()
+            count = db.exec(
+                select(func.count()).select_from(CacheEntryModel)
+                .where(CacheEntryModel.namespace == self.namespace)
+            ).one()
+            overflow = count - self.max_entries
+            if overflow > 0:
+                stale_keys = select(CacheEntryModel.key).where(
+                    CacheEntryModel.namespace == self.namespace
+                ).order_by(CacheEntryModel.last_access).limit(overflow)
+                db.exec(delete(CacheEntryModel).where(
+                    CacheEntryModel.namespace == self.namespace,
+                    CacheEntryModel.key.in_(stale_keys),
+                ))
+            db.commit()
+
+
+class ResultCache:
+    """
+    Cache hasil panggilan AI dengan nilai yang diserialisasi ke JSON,
+    sehingga setiap pemanggil selalu mendapat salinan baru.
+    Mencatat jumlah hit dan miss.
+    """
+    def __init__(self, name: str, backend):
+        self.name = name
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Optional[Any]:
+        raw = await self.backend.get(key)
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+
+    async def set(self, key: str, value: Any):
+        await self.backend.set(key, json.dumps(value, ensure_ascii=False))
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+class PerceptualHashIndex:
+    """
+    Index in-process berisi perceptual hash gambar terbaru beserta hasil
+    ekstraksinya. Lookup mencari hash dengan jarak Hamming terkecil yang masih
+    di bawah ambang batas, untuk input teks yang sama.
+    """
+    def __init__(self, max_distance: int, max_entries: int, ttl_seconds: int):
+        self.max_distance = max_distance
+        self.ttl_seconds = ttl_seconds
+        # (phash, text_key, json value, created_at), newest on the right
+        self._entries: Deque[Tuple[int, str, str, float]] = deque(maxlen=max_entries)
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, text_key: str, phash: int) -> Optional[Any]:
+        cutoff = time.time() - self.ttl_seconds
+        best: Optional[Tuple[int, str]] = None
+        for entry_hash, entry_text, value, created_at in reversed(self._entries):
+            if created_at < cutoff:
+                break  # everything older is expired too
+            if entry_text != text_key:
+                continue
+            distance = (entry_hash ^ phash).bit_count()
+            if distance <= self.max_distance and (best is None or distance < best[0]):
+                best = (distance, value)
+                if distance == 0:
+                    break
+
+        if best is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(best[1])
+
+    def add(self, text_key: str, phash: int, value: Any):
+        self._entries.append((phash, text_key, json.dumps(value, ensure_ascii=False), time.time()))
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+def build_cache(name: str, backend: str, max_entries: int, ttl_seconds: int) -> Optional[ResultCache]:
+    """Membuat ResultCache sesuai konfigurasi backend, atau None jika dimatikan."""
+    if backend == "off":
+        return None
+    if backend == "memory":
+        return ResultCache(name, MemoryCacheBackend(max_entries, ttl_seconds))
+    if backend == "sqlite":
+        return ResultCache(name, SQLiteCacheBackend(name, max_entries, ttl_seconds))
+    raise ValueError(f"Backend cache tidak dikenal: {backend!r}")
@@ -1,27 +1,200 @@
 # app/services/context_service.py
 
 import json
-from typing import List, Optional, Dict, Any
-from sqlmodel import Session as DbSession, select
-from app.models import SessionModel, MessageModel
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional, Dict, Any
+from sqlalchemy import delete, update
+from sqlmodel import Session as DbSession, or_, select
+from app.config import Settings
+from app.db import run_in_db
+from app.models import SessionModel, RecipeModel, MessageModel
+from app.services.metrics import timed
+from app.services.message_writer import MessageWriter, PendingMessage
+from app.services.session_cache import HotSession, session_cache
+
+settings = Settings()
+
+
+def session_expiry(now: Optional[datetime] = None) -> Optional[datetime]:
+    """Waktu kedaluwarsa sesi yang baru aktif (None jika TTL dimatikan)."""
+    if settings.session_ttl_seconds <= 0:
+        return None
+    return (now or datetime.utcnow()) + timedelta(seconds=settings.session_ttl_seconds)
+
+
+def delete_sessions(db: DbSession, session_ids: List[str]):
+    """Menghapus sesi beserta pesan dan resepnya dengan DELETE ... WHERE massal (tanpa commit)."""
+    db.exec(delete(MessageModel).where(MessageModel.session_id.in_(session_ids)))
+    db.exec(delete(RecipeModel).where(RecipeModel.session_id.in_(session_ids)))
+    db.exec(delete(SessionModel).where(SessionModel.id.in_(session_ids)))
+
+
+class ChatTurnContext:
+    """Data yang dibutuhkan satu giliran chat, dimuat sekaligus dari DB."""
+    def __init__(
+        self,
+        recipe: Optional[Dict[str, Any]],
+        messages: List[Dict[str, Any]],
+        history_summary: Optional[str] = None,
+        system_prompt: Optional[str] = None
+    ):
+        self.recipe = recipe
+        # Chronological user/assistant messages not yet folded into the summary,
+        # each as {"id", "role", "content"}
+        self.messages = messages
+        self.history_summary = history_summary
+        self.system_prompt = system_prompt
+
 
 class ContextService:
     """
     Mengelola state dan konteks percakapan yang disimpan di database.
     Disesuaikan untuk bekerja dengan format data baru dari ai_service.
+
+    Semua method publik bersifat async: query SQLite yang blocking dijalankan
+    di thread pool DB (lihat app.db.run_in_db), bukan di event loop.
     """
     def __init__(self, db: DbSession):
         self.db = db
+        # Chat messages go through the write-behind buffer when it is enabled
+        self.writer = message_writer if settings.message_write_behind_enabled else None
+        self.cache = session_cache
 
-    def create_context(self, recipes: List[Dict[str, Any]]) -> str:
+    @timed("db.create_context")
+    async def create_context(self, recipes: List[Dict[str, Any]]) -> str:
         """Membuat sesi baru dan menyimpan daftar resep yang dihasilkan AI."""
-        sess = SessionModel(recipes_json=recipes)
+        context_id = await run_in_db(self._create_context, recipes)
+        if self.cache is not None:
+            self.cache.put_new(context_id)
+        return context_id
+
+    @timed("db.add_recipes")
+    async def add_recipes(self, context_id: str, recipes: List[Dict[str, Any]], start_position: int = 0):
+        """
+        Menambahkan resep ke sesi yang sudah ada (dipakai saat resep tiba bertahap).
+        KeyError jika sesi sudah tidak ada.
+        """
+        await run_in_db(self._add_recipes, context_id, recipes, start_position)
+
+    @timed("db.select_recipe")
+    async def select_recipe(
+        self,
+        context_id: str,
+        recipe_id: str,
+        render_system_prompt: Optional[Callable[[Dict[str, Any]], str]] = None
+    ):
+        """
+        Menandai resep yang dipilih pengguna dalam sebuah sesi. Jika
+        render_system_prompt diberikan, system prompt chat untuk resep tersebut
+        dirender sekali dan disimpan bersama pilihan resep.
+        """
+        recipe, system_prompt = await run_in_db(self._select_recipe, context_id, recipe_id, render_system_prompt)
+        if self.cache is not None:
+            self.cache.set_recipe(context_id, recipe, system_prompt)
+
+    @timed("db.get_selected_recipe")
+    async def get_selected_recipe(self, context_id: str) -> Optional[Dict[str, Any]]:
+        """Mengambil data resep lengkap yang telah dipilih dari DB."""
+        return await run_in_db(self._get_selected_recipe, context_id)
+
+    @timed("db.append_message")
+    async def append_message(self, context_id: str, role: str, content: str):
+        """Menyimpan pesan baru (dari user atau AI) ke dalam riwayat chat."""
+        if self.writer is None:
+            record = await run_in_db(self._append_message, context_id, role, content)
+        else:
+            if not await run_in_db(self.db.get, SessionModel, context_id):
+                raise KeyError("Context ID tidak ditemukan.")
+            message = PendingMessage(context_id, role, content, datetime.utcnow())
+            self.writer.enqueue([message])
+            record = message.as_dict()
+        if self.cache is not None and role in ("user", "assistant"):
+            self.cache.add_messages(context_id, [record])
+
+    @timed("db.get_chat_history")
+    async def get_chat_history(self, context_id: str) -> List[Dict[str, str]]:
+        """
+        Mengambil riwayat percakapan yang relevan untuk diberikan sebagai konteks ke AI.
+        Hanya mengambil pesan dari 'user' dan 'assistant'.
+        """
+        # Snapshot the buffer before reading the DB; see _merge_pending
+        pending = self._pending_messages(context_id)
+        return await run_in_db(self._get_chat_history, context_id, pending)
+
+    @timed("db.end_context")
+    async def end_context(self, context_id: str):
+        """Menghapus sesi dan semua pesan terkait dari database."""
+        if self.writer is not None:
+            self.writer.discard(context_id)
+        if self.cache is not None:
+            self.cache.invalidate([context_id])
+        await run_in_db(self._end_context, context_id)
+
+    @timed("db.load_chat_turn")
+    async def load_chat_turn(self, context_id: str, history_limit: int = 0) -> ChatTurnContext:
+        """
+        Memuat semua yang dibutuhkan satu giliran chat dalam satu kali akses DB:
+        resep yang dipilih, ringkasan riwayat, dan pesan setelah ringkasan
+        (maksimal history_limit pesan terbaru; 0 = semua). recipe bernilai None
+        jika sesi tidak ada atau resep belum dipilih. Pesan yang masih di
+        buffer write-behind ikut dimuat (dengan id None). Sesi yang ada di
+        hot-session cache dilayani tanpa akses DB sama sekali.
+        """
+        if self.cache is None:
+            pending = self._pending_messages(context_id)
+            hot = await run_in_db(self._load_hot_session, context_id, history_limit, pending)
+            return _chat_turn(hot, history_limit)
+
+        hot = self.cache.get(context_id, history_limit)
+        if hot is not None:
+            return _chat_turn(hot, history_limit)
+
+        # Read enough messages for the following turns to hit the cache too
+        fetch_limit = max(history_limit, self.cache.max_messages) if history_limit > 0 else 0
+        token = self.cache.begin_load(context_id)
+        pending = self._pending_messages(context_id)
+        hot = await run_in_db(self._load_hot_session, context_id, fetch_limit, pending)
+        turn = _chat_turn(hot, history_limit)
+        self.cache.finish_load(context_id, token, hot)
+        return turn
+
+    @timed("db.update_history_summary")
+    async def update_history_summary(self, context_id: str, summary: str, upto_message_id: int):
+        """Menyimpan ringkasan riwayat chat terbaru beserta id pesan terakhir yang sudah diringkas."""
+        await run_in_db(self._update_history_summary, context_id, summary, upto_message_id)
+        if self.cache is not None:
+            self.cache.set_summary(context_id, summary, upto_message_id)
+
+    @timed("db.record_chat_turn")
+    async def record_chat_turn(self, context_id: str, user_message: str, reply: str):
+        """Menyimpan pesan pengguna dan balasan AI sekaligus dalam satu transaksi."""
+        if self.writer is None:
+            records = await run_in_db(self._record_chat_turn, context_id, user_message, reply)
+        else:
+            # Committed (and expires_at extended) by the writer's next flush
+            asked_at = datetime.utcnow()
+            messages = [
+                PendingMessage(context_id, "user", user_message, asked_at),
+                PendingMessage(context_id, "assistant", reply, datetime.utcnow()),
+            ]
+            self.writer.enqueue(messages)
+            records = [m.as_dict() for m in messages]
+        if self.cache is not None:
+            self.cache.add_messages(context_id, records)
+
+    def _pending_messages(self, context_id: str) -> List[Dict[str, Any]]:
+        return self.writer.pending_for(context_id) if self.writer is not None else []
+
+    # --- Blocking implementations (run on the DB thread pool) ---
+
+    def _create_context(self, recipes: List[Dict[str, Any]]) -> str:
+        sess = SessionModel(expires_at=session_expiry())
         self.db.add(sess)
-        self.db.commit()
-        self.db.refresh(sess)
-        
+        self.db.flush()
+        self._insert_recipes(sess.id, recipes, 0)
+
         initial_message = {
-            "role": "system_internal", 
+            "role": "system_internal",
             "content": f"Session created with recipes: {[r.get('title', 'N/A') for r in recipes]}"
         }
         msg = MessageModel(session_id=sess.id, **initial_message)
@@ -30,67 +203,222 @@ class ContextService:
 
         return sess.id
 
-    def select_recipe(self, context_id: str, recipe_id: str):
-        """Menandai resep yang dipilih pengguna dalam sebuah sesi."""
+    def _add_recipes(self, context_id: str, recipes: List[Dict[str, Any]], start_position: int):
+        # Take the write lock first: the session may be deleted while recipes
+        # are still streaming, and must not be between this check and the insert.
+        self.db.connection().exec_driver_sql("BEGIN IMMEDIATE")
+        if not self.db.get(SessionModel, context_id):
+            self.db.rollback()
+            raise KeyError("Context ID tidak ditemukan.")
+        self._insert_recipes(context_id, recipes, start_position)
+        self.db.commit()
+
+    def _insert_recipes(self, context_id: str, recipes: List[Dict[str, Any]], start_position: int):
+        self.db.add_all([
+            RecipeModel(
+                id=recipe["id"],
+                session_id=context_id,
+                position=start_position + i,
+                data={k: v for k, v in recipe.items() if k != "id"},
+            )
+            for i, recipe in enumerate(recipes)
+        ])
+
+    def _select_recipe(
+        self,
+        context_id: str,
+        recipe_id: str,
+        render_system_prompt: Optional[Callable[[Dict[str, Any]], str]]
+    ):
         sess = self.db.get(SessionModel, context_id)
         if not sess:
             raise KeyError("Context ID tidak ditemukan.")
-        
-        recipes = sess.recipes_json or []
-        if not any(r.get("id") == recipe_id for r in recipes):
+
+        recipe_row = self.db.get(RecipeModel, recipe_id)
+        if recipe_row is None or recipe_row.session_id != context_id:
             raise KeyError("Recipe ID tidak ada di dalam konteks sesi ini.")
-        
+
+        recipe = _recipe_dict(recipe_row)
         sess.selected_recipe_id = recipe_id
+        sess.expires_at = session_expiry()
+        sess.chat_system_prompt = render_system_prompt(recipe) if render_system_prompt else None
         self.db.add(sess)
         self.db.commit()
+        return recipe, sess.chat_system_prompt
 
-    def get_selected_recipe(self, context_id: str) -> Optional[Dict[str, Any]]:
-        """Mengambil data resep lengkap yang telah dipilih dari DB."""
+    def _get_selected_recipe(self, context_id: str) -> Optional[Dict[str, Any]]:
         sess = self.db.get(SessionModel, context_id)
-        if not sess or not sess.selected_recipe_id:
+        if not sess:
             return None
-        
-        for r in sess.recipes_json:
-            if r.get("id") == sess.selected_recipe_id:
-                return r
-        return None
+        return self._load_recipe(sess)
 
-    def append_message(self, context_id: str, role: str, content: str):
-        """Menyimpan pesan baru (dari user atau AI) ke dalam riwayat chat."""
+    def _load_recipe(self, sess: SessionModel) -> Optional[Dict[str, Any]]:
+        # Primary key lookup of the one selected recipe
+        if not sess.selected_recipe_id:
+            return None
+        recipe_row = self.db.get(RecipeModel, sess.selected_recipe_id)
+        return _recipe_dict(recipe_row) if recipe_row else None
+
+    def _append_message(self, context_id: str, role: str, content: str):
         sess = self.db.get(SessionModel, context_id)
         if not sess:
             raise KeyError("Context ID tidak ditemukan.")
-        
+
         msg = MessageModel(session_id=context_id, role=role, content=content)
         self.db.add(msg)
+        self.db.flush()
+        record = _message_record(msg)
         self.db.commit()
+        return record
 
-    def get_chat_history(self, context_id: str) -> List[Dict[str, str]]:
-        """
-        Mengambil riwayat percakapan yang relevan untuk diberikan sebagai konteks ke AI.
-        Hanya mengambil pesan dari 'user' dan 'assistant'.
-        """
-        statement = select(MessageModel).where(
+    def _get_chat_history(self, context_id: str, pending: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+        statement = select(MessageModel.role, MessageModel.content, MessageModel.timestamp).where(
             MessageModel.session_id == context_id,
             MessageModel.role.in_(['user', 'assistant'])
-        ).order_by(MessageModel.timestamp)
-        
-        msgs = self.db.exec(statement).all()
-        return [{"role": m.role, "content": m.content} for m in msgs]
+        ).order_by(MessageModel.timestamp, MessageModel.id)
 
-    def end_context(self, context_id: str):
-        """Menghapus sesi dan semua pesan terkait dari database."""
-        sess = self.db.get(SessionModel, context_id)
-        if not sess:
-            return
-        
-        # Hapus semua pesan yang terkait dengan sesi ini
-        messages_to_delete = self.db.exec(
-            select(MessageModel).where(MessageModel.session_id == context_id)
-        ).all()
-        for m in messages_to_delete:
-            self.db.delete(m)
-        
-        # Hapus sesi itu sendiri
-        self.db.delete(sess)
-        self.db.commit()
\ No newline at end of file
+        msgs = [
+            {"role": role, "content": content, "timestamp": timestamp}
+            for role, content, timestamp in self.db.exec(statement).all()
+        ]
+        return [{"role": m["role"], "content": m["content"]} for m in _merge_pending(msgs, pending)]
+
+    def _load_hot_session(
+        self,
+        context_id: str,
+        history_limit: int,
+        pending: List[Dict[str, Any]]
+    ) -> Optional[HotSession]:
+        # Session by primary key + history via the (session_id, timestamp)
+        # index, in one DB thread hop. pysqlite does not BEGIN before SELECTs,
+        # so open the read transaction explicitly: all three reads then see
+        # the same snapshot, even if a chat turn or the reaper commits between them.
+        self.db.connection().exec_driver_sql("BEGIN")
+        try:
+            sess = self.db.get(SessionModel, context_id)
+            recipe = self._load_recipe(sess) if sess else None
+            if recipe is None:
+                return None
+
+            statement = select(MessageModel.id, MessageModel.role, MessageModel.content, MessageModel.timestamp).where(
+                MessageModel.session_id == context_id,
+                MessageModel.role.in_(['user', 'assistant'])
+            )
+            if sess.summary_upto_message_id is not None:
+                statement = statement.where(MessageModel.id > sess.summary_upto_message_id)
+            statement = statement.order_by(MessageModel.timestamp.desc(), MessageModel.id.desc())
+            if history_limit > 0:
+                statement = statement.limit(history_limit)
+
+            rows = self.db.exec(statement).all()
+            messages = _merge_pending([
+                {"id": id_, "role": role, "content": content, "timestamp": timestamp}
+                for id_, role, content, timestamp in reversed(rows)
+            ], pending)
+            return HotSession(
+                recipe,
+                sess.chat_system_prompt,
+                sess.history_summary,
+                sess.summary_upto_message_id,
+                messages,
+                complete=history_limit <= 0 or len(rows) < history_limit,
+            )
+        finally:
+            # End the read transaction so it does not hold back WAL checkpoints
+            self.db.commit()
+
+    def _update_history_summary(self, context_id: str, summary: str, upto_message_id: int):
+        # Only move the summary forward; a slower, older update must not win.
+        self.db.exec(
+            update(SessionModel)
+            .where(
+                SessionModel.id == context_id,
+                or_(
+                    SessionModel.summary_upto_message_id.is_(None),
+                    SessionModel.summary_upto_message_id < upto_message_id,
+                ),
+            )
+            .values(history_summary=summary, summary_upto_message_id=upto_message_id)
+        )
+        self.db.commit()
+
+    def _record_chat_turn(self, context_id: str, user_message: str, reply: str):
+        asked_at = datetime.utcnow()
+        # An active conversation keeps the session alive. The UPDATE doubles as
+        # the existence check: the session may have been deleted (end_context,
+        # reaper) while the AI was answering, and its write lock keeps it so
+        # until the inserts below commit.
+        result = self.db.exec(
+            update(SessionModel).where(SessionModel.id == context_id).values(expires_at=session_expiry(asked_at))
+        )
+        if result.rowcount == 0:
+            self.db.rollback()
+            raise KeyError("Context ID tidak ditemukan.")
+
+        messages = [
+            MessageModel(session_id=context_id, role="user", content=user_message, timestamp=asked_at),
+            MessageModel(session_id=context_id, role="assistant", content=reply),
+        ]
+        self.db.add_all(messages)
+        self.db.flush()
+        records = [_message_record(m) for m in messages]
+        self.db.commit()
+        return records
+
+    def _end_context(self, context_id: str):
+        # Messages, recipes and the session itself, one bulk DELETE each
+        delete_sessions(self.db, [context_id])
+        self.db.commit()
+
+def _recipe_dict(recipe_row: RecipeModel) -> Dict[str, Any]:
+    return {**recipe_row.data, "id": recipe_row.id}
+
+
+def _message_record(msg: MessageModel) -> Dict[str, Any]:
+    return {"id": msg.id, "role": msg.role, "content": msg.content, "timestamp": msg.timestamp}
+
+
+def _chat_turn(hot: Optional[HotSession], history_limit: int) -> ChatTurnContext:
+    """ChatTurnContext berisi salinan pesan terbaru (maksimal history_limit; 0 = semua)."""
+    if hot is None or hot.recipe is None:
+        return ChatTurnContext(None, [])
+    messages = hot.messages[-history_limit:] if history_limit > 0 else hot.messages
+    return ChatTurnContext(
+        dict(hot.recipe),
+        [{"id": m["id"], "role": m["role"], "content": m["content"]} for m in messages],
+        hot.history_summary,
+        hot.system_prompt,
+    )
+
+
+def _merge_pending(persisted: List[Dict[str, Any]], pending: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Menambahkan pesan dari buffer write-behind setelah pesan yang sudah ada di DB.
+    Buffer dibaca sebelum DB, jadi pesan yang ter-commit di antaranya bisa muncul
+    di keduanya; duplikat dikenali dari (timestamp, role, content).
+    """
+    if not pending:
+        return persisted
+    seen = {(m["timestamp"], m["role"], m["content"]) for m in persisted}
+    return persisted + [m for m in pending if (m["timestamp"], m["role"], m["content"]) not in seen]
+
+
+def _on_messages_flushed(batch: List[PendingMessage]):
+    # Cached copies of buffered messages learn their DB ids
+    if session_cache is None:
+        return
+    by_session: Dict[str, List[Dict[str, Any]]] = {}
+    for message in batch:
+        if message.id is not None:
+            by_session.setdefault(message.session_id, []).append(message.as_dict())
+    for session_id, records in by_session.items():
+        session_cache.assign_ids(session_id, records)
+
+
+# Singleton instance; started from the app lifespan when write-behind is enabled
+message_writer = MessageWriter(
+    flush_interval=settings.message_flush_interval_ms / 1000,
+    batch_size=settings.message_flush_batch_size,
+    session_expiry=session_expiry,
+    on_flushed=_on_messages_flushed,
+)
@@ -0,0 +1,78 @@
+# app/services/history_service.py
+
+import math
+from typing import Callable, Dict, List, Tuple
+from app.config import Settings
+
+settings = Settings()
+
+# Rough token estimators. Register a real tokenizer with register_token_estimator().
+TOKEN_ESTIMATORS: Dict[str, Callable[[str], int]] = {
+    # ~4 characters per token is a common estimate for BPE tokenizers
+    "chars": lambda text: math.ceil(len(text) / 4),
+    # ~0.75 words per token
+    "words": lambda text: math.ceil(len(text.split()) * 4 / 3),
+}
+
+# Fixed per-message overhead (role, separators) added by chat templates
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def register_token_estimator(name: str, estimator: Callable[[str], int]):
+    """Mendaftarkan estimator token baru (misal berbasis tokenizer model)."""
+    TOKEN_ESTIMATORS[name] = estimator
+
+
+class HistoryPolicy:
+    """
+    Menentukan bagian riwayat chat yang dikirim ke AI: maksimal N giliran
+    terakhir dan tidak melebihi anggaran token. Pesan yang tidak muat
+    dikembalikan terpisah agar bisa diringkas.
+    """
+    def __init__(self, max_turns: int, token_budget: int, tokenizer: str):
+        if tokenizer not in TOKEN_ESTIMATORS:
+            raise ValueError(f"Tokenizer riwayat chat tidak dikenal: {tokenizer!r}")
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.tokenizer = tokenizer
+
+    def estimate_tokens(self, text: str) -> int:
+        return TOKEN_ESTIMATORS[self.tokenizer](text) + _MESSAGE_OVERHEAD_TOKENS
+
+    def apply(self, messages: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+        """
+        Membagi pesan (urut dari yang terlama) menjadi (window, dropped).
+        window berisi pesan terbaru yang dikirim ke AI, dropped berisi pesan
+        lama di luar window.
+        """
+        start = 0
+        if self.max_turns > 0:
+            # One turn is a user message plus the assistant reply
+            start = max(0, len(messages) - self.max_turns * 2)
+
+        if self.token_budget > 0:
+            used = 0
+            cut = len(messages)
+            for i in range(len(messages) - 1, start - 1, -1):
+                used += self.estimate_tokens(messages[i]["content"])
+                if used > self.token_budget:
+                    break
+                cut = i
+            start = cut
+
+        # Never open the window with an orphaned assistant reply
+        while start < len(messages) and messages[start]["role"] != "user":
+            start += 1
+
+        return messages[start:], messages[:start]
+
+    def max_messages(self) -> int:
+        """Jumlah pesan maksimum yang perlu dimuat dari DB (0 = tanpa batas)."""
+        return self.max_turns * 2 if self.max_turns > 0 else 0
+
+
+history_policy = HistoryPolicy(
+    max_turns=settings.chat_history_max_turns,
+    token_budget=settings.chat_history_token_budget,
+    tokenizer=settings.chat_history_tokenizer,
+)
@@ -0,0 +1,196 @@
+# app/services/image_service.py
+
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+from typing import Optional
+from fastapi import HTTPException, UploadFile, status
+from fastapi.responses import JSONResponse
+from PIL import Image, ImageOps
+from app.config import Settings
+from app.services.metrics import timed
+
+settings = Settings()
+
+_READ_CHUNK_SIZE = 64 * 1024
+# Allowance for multipart boundaries and the optional 'text' field
+_FORM_OVERHEAD_BYTES = 64 * 1024
+
+
+class ProcessedImage:
+    """Hasil preprocessing: bytes JPEG yang sudah diperkecil dan perceptual hash-nya."""
+    def __init__(self, data: bytes, phash: int):
+        self.data = data
+        self.phash = phash
+
+
+def difference_hash(image: Image.Image, hash_size: int = 8) -> int:
+    """
+    dHash 64-bit: grayscale, resize ke (hash_size+1) x hash_size, lalu bandingkan
+    setiap piksel dengan tetangga kanannya. Foto yang hampir sama (sedikit
+    bergeser, beda kompresi/cahaya) menghasilkan hash dengan jarak Hamming kecil.
+    """
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def preprocess_image(raw: bytes, max_side: int, quality: int, max_pixels: int) -> ProcessedImage:
+    """
+    Decode, rotasi sesuai EXIF, resize, dan encode ulang gambar ke JPEG,
+    sekaligus menghitung perceptual hash dari gambar yang sudah diperkecil.
+    Fungsi murni (tanpa state global) agar bisa dijalankan di process pool.
+    """
+    image = Image.open(BytesIO(raw))
+    # Reject decompression bombs from the header, before decoding any pixels
+    if image.width * image.height > max_pixels:
+        raise ValueError("Resolusi gambar terlalu besar.")
+
+    # JPEG only: let libjpeg decode at 1/2, 1/4 or 1/8 scale, still >= max_side
+    image.draft("RGB", (max_side, max_side))
+    image = ImageOps.exif_transpose(image)
+    image = image.convert("RGB")
+    image.thumbnail((max_side, max_side))  # Max 1024px by default
+
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return ProcessedImage(buffer.getvalue(), difference_hash(image))
+
+
+def _process_context() -> multiprocessing.context.BaseContext:
+    # forkserver is not available on Windows
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(method)
+
+
+class ImageService:
+    """
+    Tahap preprocessing gambar upload. Pekerjaan Pillow yang berat dijalankan
+    di pool proses/thread yang terbatas, sehingga event loop tetap responsif.
+    """
+    def __init__(self):
+        self._executor: Optional[Executor] = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if settings.image_executor == "process":
+                # Workers start after the DB and anyio threads are running; forking
+                # a multi-threaded process can deadlock the child, so never fork it
+                self._executor = ProcessPoolExecutor(
+                    max_workers=settings.image_workers, mp_context=_process_context()
+                )
+            elif settings.image_executor == "thread":
+                self._executor = ThreadPoolExecutor(
+                    max_workers=settings.image_workers, thread_name_prefix="image"
+                )
+            else:
+                raise ValueError(f"Executor gambar tidak dikenal: {settings.image_executor!r}")
+        return self._executor
+
+    def shutdown(self):
+        """Menutup pool preprocessing gambar. Dipanggil saat aplikasi berhenti."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def read_upload(self, upload: UploadFile) -> bytes:
+        """Membaca file upload per potongan dan berhenti begitu melewati batas ukuran."""
+        max_bytes = settings.image_max_upload_bytes
+        if upload.size is not None and upload.size > max_bytes:
+            raise _too_large()
+
+        if upload.size is not None:
+            # Size is known and within the limit: read it in one go, no re-joining
+            return await upload.read()
+
+        chunks = []
+        total = 0
+        while chunk := await upload.read(_READ_CHUNK_SIZE):
+            total += len(chunk)
+            if total > max_bytes:
+                raise _too_large()
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    @timed("image_preprocess")
+    async def preprocess_upload(self, upload: UploadFile) -> ProcessedImage:
+        """Membaca dan memproses gambar upload, mengembalikan JPEG yang sudah diperkecil beserta hash-nya."""
+        raw_content = await self.read_upload(upload)
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(
+                self._get_executor(),
+                functools.partial(
+                    preprocess_image,
+                    raw_content,
+                    settings.image_max_side,
+                    settings.image_jpeg_quality,
+                    settings.image_max_pixels,
+                ),
+            )
+        except Exception:
+            raise HTTPException(status_code=400, detail="Gagal memproses file gambar.")
+
+
+def _too_large() -> HTTPException:
+    limit_mb = settings.image_max_upload_bytes / (1024 * 1024)
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"Ukuran gambar melebihi batas {limit_mb:.0f} MB.",
+    )
+
+
+class UploadSizeLimitMiddleware:
+    """
+    ASGI middleware: menolak upload multipart yang terlalu besar sebelum
+    FastAPI membaca dan men-spool seluruh body. Content-Length dicek di awal;
+    untuk body tanpa Content-Length (chunked), byte dihitung saat dibaca.
+    """
+    def __init__(self, app, max_body_bytes: Optional[int] = None):
+        self.app = app
+        self.max_body_bytes = max_body_bytes or settings.image_max_upload_bytes + _FORM_OVERHEAD_BYTES
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._is_multipart(scope):
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > self.max_body_bytes:
+            await self._reject(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_bytes:
+                    # FastAPI re-raises HTTPException from body parsing as-is
+                    raise _too_large()
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    @staticmethod
+    def _is_multipart(scope) -> bool:
+        content_type = dict(scope["headers"]).get(b"content-type", b"")
+        return content_type.startswith(b"multipart/form-data")
+
+    async def _reject(self, scope, receive, send):
+        exc = _too_large()
+        response = JSONResponse({"detail": exc.detail}, status_code=exc.status_code)
+        await response(scope, receive, send)
+
+
+# Singleton instance
+image_service = ImageService()
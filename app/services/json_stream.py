@@ -0,0 +1,149 @@
+# app/services/json_stream.py
+
+import json
+import re
+from typing import Any, Callable, List, Optional
+
+_FENCE_RE = re.compile(r"```(?:json)?", re.IGNORECASE)
+
+
+class JsonStreamParser:
+    """
+    Parser JSON inkremental berbasis penyeimbangan kurung yang sadar string.
+    Teks bisa diumpankan sepotong demi sepotong (misal token stream dari AI);
+    setiap objek/array di dalam array pertama langsung di-parse begitu kurung
+    penutupnya tiba, sehingga resep bisa dipakai sebelum respons selesai.
+    Teks sebelum root dan setelah kurung penutup root diabaikan; kurung di
+    dalam string berkutip pada teks pembuka tidak dianggap root. Root yang
+    tidak valid, atau ditolak oleh accept, dilewati dan pencarian dilanjutkan
+    setelah kurung pembukanya (kecuali elemennya sudah dikembalikan).
+
+    Dengan prose_quotes=False, kutip di teks pembuka diabaikan; dipakai untuk
+    scan ulang jika satu kutip tanpa pasangan (misal 5" untuk inci) membuat
+    root tidak pernah ditemukan.
+    """
+    def __init__(self, accept: Optional[Callable[[Any], bool]] = None, prose_quotes: bool = True):
+        self._accept = accept
+        self._prose_quotes = prose_quotes
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self.root_start = -1
+        self._root_end = -1
+        # Depth of the elements of the first array seen (0 = no array yet)
+        self._items_depth = 0
+        self._item_start = -1
+        self.items: List[Any] = []
+        self._value: Any = None
+        self._has_value = False
+
+    @property
+    def done(self) -> bool:
+        return self._root_end != -1
+
+    @property
+    def text(self) -> str:
+        """Seluruh teks yang sudah diumpankan."""
+        return self._buffer
+
+    def feed(self, chunk: str) -> List[Any]:
+        """Menambahkan teks dan mengembalikan elemen array yang baru selesai."""
+        self._buffer += chunk
+        buf = self._buffer
+        completed: List[Any] = []
+        i = self._pos
+        while i < len(buf) and not self.done:
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"' and (self.root_start != -1 or self._prose_quotes):
+                # Also in the prose before the root: a quoted "[" is not the root
+                self._in_string = True
+            elif self.root_start == -1:
+                if ch in "[{":
+                    self.root_start = i
+                    self._depth = 1
+                    if ch == "[":
+                        self._items_depth = 2
+            elif ch in "[{":
+                self._depth += 1
+                if ch == "[" and not self._items_depth:
+                    self._items_depth = self._depth + 1
+                if self._depth == self._items_depth:
+                    self._item_start = i
+            elif ch in "]}":
+                if self._depth == self._items_depth and self._item_start != -1:
+                    try:
+                        item = json.loads(buf[self._item_start:i + 1])
+                    except json.JSONDecodeError:
+                        pass  # malformed element: skip it, keep the rest
+                    else:
+                        self.items.append(item)
+                        completed.append(item)
+                    self._item_start = -1
+                self._depth -= 1
+                if self._depth == 0:
+                    if self.items or self._take_root(buf[self.root_start:i + 1]):
+                        self._root_end = i + 1
+                    else:
+                        # e.g. "[see below]" in prose: search again after its bracket
+                        i = self.root_start
+                        self.root_start = -1
+                        self._items_depth = 0
+                        self._item_start = -1
+            i += 1
+        self._pos = i
+        return completed
+
+    def _take_root(self, text: str) -> bool:
+        try:
+            value = json.loads(text)
+        except json.JSONDecodeError:
+            return False
+        if self._accept is not None and not self._accept(value):
+            return False
+        self._value, self._has_value = value, True
+        return True
+
+    def value(self) -> Any:
+        """Nilai JSON root yang sudah lengkap."""
+        if not self.done:
+            raise ValueError("JSON belum lengkap.")
+        if self._has_value:
+            return self._value
+        try:
+            return json.loads(self._buffer[self.root_start:self._root_end])
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Gagal mem-parse JSON yang diekstrak: {e}")
+
+
+def extract_json(text: str, accept: Optional[Callable[[Any], bool]] = None) -> Any:
+    """
+    Mengambil nilai JSON pertama yang valid (dan diterima accept, jika ada)
+    dari respons teks AI. Blok ```json diutamakan, teks tambahan (termasuk
+    yang mengandung kurung) diabaikan. Jika output terpotong, elemen array
+    yang sudah lengkap tetap dikembalikan.
+    """
+    fence = _FENCE_RE.search(text)
+    body = text[fence.end():] if fence else text
+    parser = JsonStreamParser(accept)
+    parser.feed(body)
+    if not parser.done and not parser.items:
+        # e.g. an unmatched quote in the prose left the scan inside a string
+        parser = JsonStreamParser(accept, prose_quotes=False)
+        parser.feed(body)
+    if parser.done:
+        try:
+            return parser.value()
+        except ValueError:
+            pass  # elements were already complete; fall back to them below
+    if parser.items:
+        return parser.items
+    raise ValueError("Tidak ada blok JSON yang valid ditemukan dalam respons AI.")
@@ -0,0 +1,122 @@
+# app/services/maintenance.py
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional
+from sqlmodel import Session as DbSession, and_, or_, select
+from app.config import Settings
+from app.db import engine, run_in_db
+from app.models import SessionModel
+from app.services.context_service import delete_sessions
+from app.services.session_cache import session_cache
+
+settings = Settings()
+logger = logging.getLogger(__name__)
+
+
+class SessionReaper:
+    """
+    Job background yang dijalankan dari lifespan aplikasi: menghapus sesi
+    kedaluwarsa (beserta pesan dan resepnya) per batch, lalu melakukan
+    wal_checkpoint dan, jika cukup banyak halaman kosong, VACUUM.
+    Setiap batch adalah transaksi pendek tersendiri agar writer lain tidak
+    tertahan lama.
+    """
+    def __init__(self, interval: int, batch_size: int, ttl_seconds: int):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.ttl_seconds = ttl_seconds
+        self._task: Optional[asyncio.Task] = None
+        self._last_vacuum = time.monotonic()
+
+    def start(self):
+        if self.ttl_seconds > 0 and self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Pembersihan sesi kedaluwarsa gagal")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> int:
+        """Satu putaran pembersihan; mengembalikan jumlah sesi yang dihapus."""
+        deleted = 0
+        while True:
+            ids = await run_in_db(self._delete_expired_batch)
+            if session_cache is not None:
+                session_cache.invalidate(ids)
+            deleted += len(ids)
+            if len(ids) < self.batch_size:
+                break
+
+        if deleted:
+            logger.info("Menghapus %d sesi kedaluwarsa", deleted)
+            await run_in_db(_checkpoint_wal)
+
+        vacuum_interval = settings.db_vacuum_interval_seconds
+        if vacuum_interval > 0 and time.monotonic() - self._last_vacuum >= vacuum_interval:
+            self._last_vacuum = time.monotonic()
+            await run_in_db(_vacuum_if_fragmented, settings.db_vacuum_min_free_ratio)
+        return deleted
+
+    def _delete_expired_batch(self) -> List[str]:
+        now = datetime.utcnow()
+        with DbSession(engine) as db:
+            ids = db.exec(
+                select(SessionModel.id)
+                .where(or_(
+                    SessionModel.expires_at < now,
+                    # Sessions created before expires_at existed
+                    and_(
+                        SessionModel.expires_at.is_(None),
+                        SessionModel.created_at < now - timedelta(seconds=self.ttl_seconds),
+                    ),
+                ))
+                .limit(self.batch_size)
+            ).all()
+            if ids:
+                delete_sessions(db, list(ids))
+                db.commit()
+            return list(ids)
+
+
+def _checkpoint_wal():
+    """Memindahkan isi WAL ke file DB dan mengosongkan file WAL."""
+    with engine.connect() as conn:
+        conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def _vacuum_if_fragmented(min_free_ratio: float):
+    """VACUUM hanya jika porsi halaman kosong (freelist) cukup besar."""
+    # VACUUM cannot run inside a transaction
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        page_count = conn.exec_driver_sql("PRAGMA page_count").scalar()
+        free_pages = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+        if not page_count or free_pages / page_count < min_free_ratio:
+            return
+        logger.info("VACUUM database: %d dari %d halaman kosong", free_pages, page_count)
+        conn.exec_driver_sql("VACUUM")
+        # In WAL mode the rebuilt pages land in the WAL first; fold them back
+        conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+# Singleton instance, started from the app lifespan
+session_reaper = SessionReaper(
+    interval=settings.session_reaper_interval_seconds,
+    batch_size=settings.session_reaper_batch_size,
+    ttl_seconds=settings.session_ttl_seconds,
+)
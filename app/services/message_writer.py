@@ -0,0 +1,159 @@
+# app/services/message_writer.py
+
+import asyncio
+import logging
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+from sqlalchemy import update
+from sqlmodel import Session as DbSession, select
+from app.db import engine, run_in_db
+from app.models import MessageModel, SessionModel
+
+logger = logging.getLogger(__name__)
+
+
+class PendingMessage:
+    """Pesan chat yang sudah diterima tetapi belum ditulis ke DB."""
+    def __init__(self, session_id: str, role: str, content: str, timestamp: datetime):
+        self.session_id = session_id
+        self.role = role
+        self.content = content
+        self.timestamp = timestamp
+        # Set once the message has been written
+        self.id: Optional[int] = None
+
+    def as_dict(self) -> Dict:
+        return {"id": self.id, "role": self.role, "content": self.content, "timestamp": self.timestamp}
+
+
+class MessageWriter:
+    """
+    Write-behind untuk insert MessageModel: pesan ditampung di memori lalu
+    ditulis dalam satu transaksi (satu fsync) setiap flush_interval detik
+    atau begitu batch_size pesan terkumpul. Pesan yang belum tertulis tetap
+    terlihat lewat pending_for() (read-your-writes), dan stop() melakukan
+    flush terakhir saat aplikasi berhenti.
+
+    Pesan untuk sesi yang sudah dihapus saat flush berjalan dibuang.
+    """
+    def __init__(
+        self,
+        flush_interval: float,
+        batch_size: int,
+        session_expiry: Callable[[datetime], Optional[datetime]],
+        on_flushed: Optional[Callable[[List[PendingMessage]], None]] = None
+    ):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._session_expiry = session_expiry
+        # Called on the event loop with each committed batch (ids filled in)
+        self._on_flushed = on_flushed
+        self._pending: List[PendingMessage] = []
+        # Taken out of _pending but not yet committed; still visible to readers
+        self._in_flight: List[PendingMessage] = []
+        self._has_pending = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    def start(self):
+        if self._task is None:
+            self._closing = False
+            # Bind the loop primitives to the loop the app runs on
+            self._has_pending = asyncio.Event()
+            self._batch_full = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            if self._pending:
+                self._has_pending.set()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Menghentikan loop flush dan menulis semua pesan yang tersisa."""
+        if self._task is not None:
+            self._closing = True
+            self._has_pending.set()
+            self._batch_full.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    def enqueue(self, messages: List[PendingMessage]):
+        self._pending.extend(messages)
+        self._has_pending.set()
+        if len(self._pending) >= self.batch_size:
+            self._batch_full.set()
+
+    @property
+    def backlog(self) -> int:
+        """Jumlah pesan yang belum ter-commit."""
+        return len(self._pending) + len(self._in_flight)
+
+    def pending_for(self, session_id: str) -> List[Dict]:
+        """Pesan sesi ini yang belum ter-commit, urut dari yang terlama."""
+        return [m.as_dict() for m in (*self._in_flight, *self._pending) if m.session_id == session_id]
+
+    def discard(self, session_id: str):
+        """Membuang pesan yang belum ditulis untuk sesi yang dihapus."""
+        self._pending = [m for m in self._pending if m.session_id != session_id]
+
+    async def flush(self) -> bool:
+        async with self._flush_lock:
+            self._has_pending.clear()
+            self._batch_full.clear()
+            if not self._pending:
+                return True
+            batch, self._pending = self._pending, []
+            self._in_flight.extend(batch)
+            try:
+                await run_in_db(self._write, batch)
+            except Exception:
+                logger.exception("Gagal menulis %d pesan chat, dicoba lagi", len(batch))
+                self._pending[:0] = batch
+                self._has_pending.set()
+                return False
+            else:
+                if self._on_flushed is not None:
+                    self._on_flushed(batch)
+                return True
+            finally:
+                self._in_flight = [m for m in self._in_flight if m not in batch]
+
+    async def _run(self):
+        while not self._closing:
+            await self._has_pending.wait()
+            if not self._closing:
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            if not await self.flush():
+                await asyncio.sleep(self.flush_interval)
+
+    def _write(self, batch: List[PendingMessage]):
+        with DbSession(engine) as db:
+            # Take the write lock up front so the session check and the inserts
+            # are atomic with respect to end_context and the session reaper.
+            db.connection().exec_driver_sql("BEGIN IMMEDIATE")
+            session_ids = {m.session_id for m in batch}
+            existing = set(db.exec(select(SessionModel.id).where(SessionModel.id.in_(session_ids))).all())
+
+            written = [m for m in batch if m.session_id in existing]
+            rows = [
+                MessageModel(session_id=m.session_id, role=m.role, content=m.content, timestamp=m.timestamp)
+                for m in written
+            ]
+            db.add_all(rows)
+            db.flush()
+            row_ids = [row.id for row in rows]
+            # An active conversation keeps the session alive
+            for session_id in existing:
+                latest = max(m.timestamp for m in batch if m.session_id == session_id)
+                db.exec(
+                    update(SessionModel)
+                    .where(SessionModel.id == session_id)
+                    .values(expires_at=self._session_expiry(latest))
+                )
+            db.commit()
+            for m, row_id in zip(written, row_ids):
+                m.id = row_id
@@ -0,0 +1,121 @@
+# app/services/rate_limiter.py
+
+import math
+import time
+from typing import Dict, Optional, Tuple
+from sqlalchemy import delete
+from sqlmodel import Session as DbSession
+from app.db import engine, run_in_db
+from app.models import RateLimitBucketModel
+
+# Per-key state: (window index, count in current window, count in previous window)
+WindowState = Tuple[int, int, int]
+
+
+def sliding_window_hit(
+    state: Optional[WindowState],
+    now: float,
+    limit: int,
+    window: int
+) -> Tuple[bool, WindowState, float]:
+    """
+    Algoritma sliding-window counter dengan state O(1) per key.
+    Jumlah request diperkirakan dari hitungan window sebelumnya (diberi bobot
+    sesuai sisa overlap) ditambah hitungan window saat ini.
+    Mengembalikan (diizinkan, state baru, detik hingga boleh mencoba lagi).
+    """
+    index = int(now // window)
+    current, previous = 0, 0
+    if state is not None:
+        state_index, state_current, state_previous = state
+        if state_index == index:
+            current, previous = state_current, state_previous
+        elif state_index == index - 1:
+            previous = state_current
+
+    elapsed = now - index * window
+    weight = 1 - elapsed / window
+    if previous * weight + current < limit:
+        return True, (index, current + 1, previous), 0.0
+
+    if current >= limit or previous == 0:
+        retry_after = window - elapsed
+    else:
+        # Wait until the previous window's weight has decayed enough
+        retry_after = window * (1 - (limit - current) / previous) - elapsed
+    return False, (index, current, previous), max(retry_after, 1.0)
+
+
+class MemoryRateLimitBackend:
+    """Backend per-proses. Key yang sudah tidak aktif dibuang secara berkala."""
+    def __init__(self, sweep_interval: int):
+        self._buckets: Dict[str, Tuple[WindowState, float]] = {}
+        self._sweep_interval = sweep_interval
+        self._next_sweep = time.time() + sweep_interval
+
+    async def hit(self, key: str, limit: int, window: int) -> Tuple[bool, float]:
+        now = time.time()
+        if now >= self._next_sweep:
+            self._sweep(now)
+
+        entry = self._buckets.get(key)
+        allowed, state, retry_after = sliding_window_hit(entry[0] if entry else None, now, limit, window)
+        # After two idle windows a key carries no information and can be dropped
+        self._buckets[key] = (state, (state[0] + 2) * window)
+        return allowed, retry_after
+
+    def _sweep(self, now: float):
+        expired = [key for key, (_, expires_at) in self._buckets.items() if expires_at <= now]
+        for key in expired:
+            del self._buckets[key]
+        self._next_sweep = now + self._sweep_interval
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class SQLiteRateLimitBackend:
+    """
+    Backend bersama untuk deployment multi-worker (gunicorn): state disimpan
+    di database aplikasi. BEGIN IMMEDIATE mengunci penulis lain selama
+    read-modify-write, sehingga hitungan tetap benar lintas proses.
+    """
+    def __init__(self, sweep_interval: int):
+        self._sweep_interval = sweep_interval
+        self._next_sweep = time.time() + sweep_interval
+
+    async def hit(self, key: str, limit: int, window: int) -> Tuple[bool, float]:
+        return await run_in_db(self._hit, key, limit, window)
+
+    def _hit(self, key: str, limit: int, window: int) -> Tuple[bool, float]:
+        now = time.time()
+        with DbSession(engine) as db:
+            db.connection().exec_driver_sql("BEGIN IMMEDIATE")
+            if now >= self._next_sweep:
+                db.exec(delete(RateLimitBucketModel).where(RateLimitBucketModel.expires_at <= now))
+                self._next_sweep = now + self._sweep_interval
+
+            bucket = db.get(RateLimitBucketModel, key)
+            state = (bucket.window_index, bucket.current, bucket.previous) if bucket else None
+            allowed, state, retry_after = sliding_window_hit(state, now, limit, window)
+
+            if bucket is None:
+                bucket = RateLimitBucketModel(key=key)
+            bucket.window_index, bucket.current, bucket.previous = state
+            bucket.expires_at = (state[0] + 2) * window
+            db.add(bucket)
+            db.commit()
+        return allowed, retry_after
+
+
+def build_rate_limit_backend(backend: str, sweep_interval: int):
+    """Membuat backend rate limiter sesuai konfigurasi."""
+    if backend == "memory":
+        return MemoryRateLimitBackend(sweep_interval)
+    if backend == "sqlite":
+        return SQLiteRateLimitBackend(sweep_interval)
+    raise ValueError(f"Backend rate limit tidak dikenal: {backend!r}")
+
+
+def retry_after_header(seconds: float) -> str:
+    return str(math.ceil(seconds))
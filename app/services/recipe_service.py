@@ -1,8 +1,20 @@
 # app/services/recipe_service.py
-from typing import Optional, Tuple, List, Dict, Any
-from fastapi import UploadFile, HTTPException
+import asyncio
+import logging
+from contextlib import aclosing
+from typing import AsyncIterator, Optional, Tuple, List, Dict, Any
+from fastapi import HTTPException
+from app.config import Settings
+from app.db import db_session
 from app.services.ai_service import ai_client
-from app.services.context_service import ContextService
+from app.services.context_service import ChatTurnContext, ContextService
+from app.services.history_service import history_policy
+from app.services.image_service import ProcessedImage
+
+settings = Settings()
+logger = logging.getLogger(__name__)
+
+_NO_RECIPES_DETAIL = "Maaf, tidak ada resep yang bisa dibuat dari bahan-bahan tersebut."
 
 class RecipeService:
     """
@@ -11,39 +23,105 @@ class RecipeService:
     """
     def __init__(self):
         self.ai = ai_client
+        self.history_policy = history_policy
+        # Background summary updates: strong refs + one per session at a time
+        self._summary_tasks: set = set()
+        self._summarizing: set = set()
 
     async def handle_initial_request(
         self,
         context_service: ContextService,
         text: Optional[str],
-        image: Optional[UploadFile]
+        image: Optional[ProcessedImage]
     ) -> Tuple[str, List[Dict[str, Any]]]:
         """
         Menangani permintaan awal dari pengguna (teks/gambar), mengekstrak bahan,
         membuat resep, dan memulai sesi konteks baru.
+        image adalah hasil preprocessing dari image_service.
         """
-        # Menggunakan satu fungsi terpadu dari ai_service
-        ingredients = await self.ai.extract_ingredients(text_input=text, image_file=image)
-        if not ingredients:
-            # Jika tidak ada bahan valid yang ditemukan, kita bisa berhenti di sini.
-            raise HTTPException(status_code=400, detail="Tidak ada bahan makanan valid yang dapat ditemukan dari input Anda.")
+        ingredients = await self._extract_ingredients(text, image)
         
         recipes = await self.ai.generate_recipes(ingredients)
         if not recipes:
-            raise HTTPException(status_code=404, detail="Maaf, tidak ada resep yang bisa dibuat dari bahan-bahan tersebut.")
+            raise HTTPException(status_code=404, detail=_NO_RECIPES_DETAIL)
 
         # Memulai sesi konteks dengan resep yang dihasilkan
-        context_id = context_service.create_context(recipes)
+        context_id = await context_service.create_context(recipes)
         return context_id, recipes
 
-    def select_recipe(
+    async def handle_initial_request_stream(
+        self,
+        context_service: ContextService,
+        text: Optional[str],
+        image: Optional[ProcessedImage]
+    ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Versi streaming dari handle_initial_request. Bahan diekstrak dan sesi
+        dibuat sebelum stream dimulai (error tetap berupa HTTP 4xx), lalu
+        mengembalikan async iterator berisi event (nama, data): "session" dengan
+        context_id dan bahan, kemudian satu "recipe" untuk setiap resep yang selesai.
+        """
+        ingredients = await self._extract_ingredients(text, image)
+        # Once the headers are sent a 503 can no longer be returned
+        self.ai.admission.ensure_capacity()
+        context_id = await context_service.create_context([])
+        return self._stream_recipes(context_id, ingredients)
+
+    async def _stream_recipes(
+        self,
+        context_id: str,
+        ingredients: List[str]
+    ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """Meneruskan resep dari AI satu per satu; setiap resep langsung disimpan ke sesi."""
+        yield "session", {"context_id": context_id, "ingredients": ingredients}
+
+        recipes: List[Dict[str, Any]] = []
+        try:
+            async with aclosing(self.ai.generate_recipes_stream(ingredients)) as stream:
+                async for recipe in stream:
+                    recipes.append(recipe)
+                    # Saved before it is sent, so the client can select it right away
+                    try:
+                        async with db_session() as db:
+                            await ContextService(db).add_recipes(context_id, [recipe], start_position=len(recipes) - 1)
+                    except KeyError as e:
+                        # The session was deleted mid-stream; stop generating for it
+                        raise HTTPException(status_code=404, detail=str(e))
+                    yield "recipe", recipe
+            if not recipes:
+                raise HTTPException(status_code=404, detail=_NO_RECIPES_DETAIL)
+        except Exception:
+            if not recipes:
+                # Nothing usable was produced: do not leave an empty session behind
+                async with db_session() as db:
+                    await ContextService(db).end_context(context_id)
+            raise
+
+    async def _extract_ingredients(self, text: Optional[str], image: Optional[ProcessedImage]) -> List[str]:
+        # Menggunakan satu fungsi terpadu dari ai_service
+        ingredients = await self.ai.extract_ingredients(
+            text_input=text,
+            image_bytes=image.data if image else None,
+            image_hash=image.phash if image else None,
+        )
+        if not ingredients:
+            # Jika tidak ada bahan valid yang ditemukan, kita bisa berhenti di sini.
+            raise HTTPException(status_code=400, detail="Tidak ada bahan makanan valid yang dapat ditemukan dari input Anda.")
+        return ingredients
+
+    async def select_recipe(
         self,
         context_service: ContextService,
         context_id: str,
         recipe_id: str
     ):
-        """Meneruskan permintaan pemilihan resep ke context_service."""
-        context_service.select_recipe(context_id, recipe_id)
+        """
+        Meneruskan permintaan pemilihan resep ke context_service. System prompt
+        chat dirender sekali di sini, bukan di setiap giliran chat.
+        """
+        await context_service.select_recipe(
+            context_id, recipe_id, render_system_prompt=self.ai.build_chat_system_prompt
+        )
 
     async def handle_chat_message(
         self,
@@ -54,34 +132,125 @@ class RecipeService:
         """
         Menangani pesan chat dari pengguna secara kontekstual.
         """
-        recipe = context_service.get_selected_recipe(context_id)
-        if not recipe:
-            raise HTTPException(status_code=404, detail="Resep belum dipilih atau ID konteks tidak valid.")
-        
-        # PERBAIKAN URUTAN: Simpan pesan pengguna terlebih dahulu.
-        context_service.append_message(context_id, "user", message)
+        # Satu akses DB: resep yang dipilih + riwayat chat sebelum pesan ini.
+        turn = await self._load_chat_turn(context_service, context_id)
+        chat_history, dropped = self._history_window(turn)
 
-        # PERUBAHAN KRUSIAL: Ambil riwayat chat untuk diberikan ke AI sebagai memori.
-        chat_history = context_service.get_chat_history(context_id)
-        
         # Panggil AI dengan konteks resep, pertanyaan baru, DAN riwayat chat.
         reply = await self.ai.answer_question(
-            recipe=recipe, 
+            recipe=turn.recipe, 
             question=message, 
-            chat_history=chat_history
+            chat_history=chat_history,
+            history_summary=turn.history_summary,
+            system_prompt=turn.system_prompt
         )
         
-        # Simpan balasan dari AI ke dalam database.
-        context_service.append_message(context_id, "assistant", reply)
+        # Simpan pesan pengguna dan balasan AI dalam satu transaksi.
+        await context_service.record_chat_turn(context_id, message, reply)
+        self._schedule_summary_update(context_id, turn.history_summary, dropped)
         return reply
 
-    def end_session(
+    async def handle_chat_message_stream(
+        self,
+        context_service: ContextService,
+        context_id: str,
+        message: str
+    ) -> AsyncIterator[str]:
+        """
+        Versi streaming dari handle_chat_message. Validasi dilakukan sebelum
+        stream dimulai agar error tetap berupa HTTP 4xx (atau 503 jika antrean
+        AI sudah penuh). Mengembalikan async iterator berisi potongan balasan AI.
+        """
+        turn = await self._load_chat_turn(context_service, context_id)
+        # Once the SSE headers are sent a 503 can no longer be returned
+        self.ai.admission.ensure_capacity()
+        return self._stream_and_persist_reply(context_id, turn, message)
+
+    async def _stream_and_persist_reply(
+        self,
+        context_id: str,
+        turn: ChatTurnContext,
+        message: str
+    ) -> AsyncIterator[str]:
+        """Meneruskan delta dari AI, lalu menyimpan pesan dan balasan utuh setelah stream selesai."""
+        chat_history, dropped = self._history_window(turn)
+        parts: List[str] = []
+        async for delta in self.ai.answer_question_stream(
+            recipe=turn.recipe,
+            question=message,
+            chat_history=chat_history,
+            history_summary=turn.history_summary,
+            system_prompt=turn.system_prompt
+        ):
+            parts.append(delta)
+            yield delta
+
+        # The request-scoped DB session is already closed once the response body
+        # starts streaming, so persist the turn with a fresh session.
+        try:
+            async with db_session() as db:
+                await ContextService(db).record_chat_turn(context_id, message, "".join(parts))
+        except KeyError as e:
+            # The session was deleted while the reply was streaming
+            raise HTTPException(status_code=404, detail=str(e))
+        self._schedule_summary_update(context_id, turn.history_summary, dropped)
+
+    async def _load_chat_turn(self, context_service: ContextService, context_id: str) -> ChatTurnContext:
+        """Memuat data giliran chat; 404 jika sesi tidak ada atau resep belum dipilih."""
+        # With summaries on, every unsummarized message is needed so the ones
+        # leaving the window can be folded in; otherwise load only the window.
+        history_limit = 0 if settings.chat_summary_enabled else self.history_policy.max_messages()
+        turn = await context_service.load_chat_turn(context_id, history_limit=history_limit)
+        if not turn.recipe:
+            raise HTTPException(status_code=404, detail="Resep belum dipilih atau ID konteks tidak valid.")
+        return turn
+
+    def _history_window(self, turn: ChatTurnContext) -> Tuple[List[Dict[str, str]], List[Dict[str, Any]]]:
+        """Menerapkan kebijakan riwayat: (pesan untuk AI, pesan lama yang perlu diringkas)."""
+        window, dropped = self.history_policy.apply(turn.messages)
+        chat_history = [{"role": m["role"], "content": m["content"]} for m in window]
+        return chat_history, dropped
+
+    def _schedule_summary_update(
+        self,
+        context_id: str,
+        previous_summary: Optional[str],
+        dropped: List[Dict[str, Any]]
+    ):
+        """Meringkas pesan yang keluar dari window di background, agar tidak menambah latensi chat."""
+        # Messages still in the write-behind buffer have no id yet; they are
+        # always the newest, so they are summarized on a later turn.
+        dropped = [m for m in dropped if m["id"] is not None]
+        if not settings.chat_summary_enabled or not dropped or context_id in self._summarizing:
+            return
+        self._summarizing.add(context_id)
+        task = asyncio.create_task(self._update_summary(context_id, previous_summary, dropped))
+        self._summary_tasks.add(task)
+        task.add_done_callback(self._summary_tasks.discard)
+
+    async def _update_summary(
+        self,
+        context_id: str,
+        previous_summary: Optional[str],
+        dropped: List[Dict[str, Any]]
+    ):
+        try:
+            summary = await self.ai.summarize_history(previous_summary, dropped)
+            async with db_session() as db:
+                await ContextService(db).update_history_summary(context_id, summary, dropped[-1]["id"])
+        except Exception:
+            # The next turn simply retries with the same unsummarized messages.
+            logger.exception("Gagal memperbarui ringkasan riwayat chat untuk sesi %s", context_id)
+        finally:
+            self._summarizing.discard(context_id)
+
+    async def end_session(
         self,
         context_service: ContextService,
         context_id: str
     ):
         """Meneruskan permintaan penghentian sesi ke context_service."""
-        context_service.end_context(context_id)
+        await context_service.end_context(context_id)
 
 
 # Singleton instance
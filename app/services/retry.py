@@ -0,0 +1,94 @@
+# app/services/retry.py
+
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Optional
+import httpx
+
+# Transient upstream statuses worth another attempt
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Membaca header Retry-After (detik atau tanggal HTTP) menjadi jumlah detik."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def describe_error(error: Exception) -> str:
+    """Deskripsi singkat error upstream untuk log."""
+    if isinstance(error, httpx.HTTPStatusError):
+        return f"HTTP {error.response.status_code}"
+    if isinstance(error, httpx.HTTPError):
+        return type(error).__name__
+    return str(error)
+
+
+class RetryPolicy:
+    """
+    Exponential backoff dengan full jitter untuk error sementara dari upstream
+    (timeout, error koneksi, 429, 5xx). Retry-After dari upstream dihormati;
+    jika lebih lama dari max_delay, percobaan untuk model ini dihentikan agar
+    model cadangan bisa dicoba.
+    """
+    def __init__(self, max_retries: int, base_delay: float, max_delay: float):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @staticmethod
+    def is_retryable(error: Exception) -> bool:
+        if isinstance(error, httpx.HTTPStatusError):
+            return error.response.status_code in RETRYABLE_STATUS_CODES
+        return isinstance(error, (httpx.TimeoutException, httpx.TransportError))
+
+    def backoff(self, attempt: int, error: Exception) -> Optional[float]:
+        """
+        Jeda sebelum percobaan ke-(attempt + 1), atau None jika tidak perlu
+        dicoba lagi dengan model yang sama.
+        """
+        if attempt >= self.max_retries or not self.is_retryable(error):
+            return None
+
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if isinstance(error, httpx.HTTPStatusError):
+            retry_after = parse_retry_after(error.response.headers.get("Retry-After"))
+            if retry_after is not None:
+                if retry_after > self.max_delay:
+                    return None
+                delay = max(delay, retry_after)
+        return delay
+
+
+async def hedged(call: Callable[[], Awaitable[Any]], delay: float) -> Any:
+    """
+    Hedged request: jika panggilan pertama belum selesai setelah `delay` detik,
+    panggilan kedua yang identik dimulai. Hasil sukses pertama yang dipakai,
+    sisanya dibatalkan. Exception hanya dilempar jika keduanya gagal.
+    """
+    tasks = {asyncio.ensure_future(call())}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            tasks.add(asyncio.ensure_future(call()))
+
+        error: Optional[BaseException] = None
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,152 @@
+# app/services/session_cache.py
+
+from typing import Any, Dict, Iterable, List, Optional
+from cachetools import TTLCache
+from app.config import Settings
+
+settings = Settings()
+
+
+class HotSession:
+    """State sesi yang dibutuhkan satu giliran chat, disimpan di memori."""
+    def __init__(
+        self,
+        recipe: Optional[Dict[str, Any]],
+        system_prompt: Optional[str],
+        history_summary: Optional[str],
+        summary_upto_message_id: Optional[int],
+        messages: List[Dict[str, Any]],
+        complete: bool
+    ):
+        self.recipe = recipe
+        self.system_prompt = system_prompt
+        self.history_summary = history_summary
+        self.summary_upto_message_id = summary_upto_message_id
+        # Newest user/assistant messages after the summary, as
+        # {"id", "role", "content", "timestamp"}; id is None until persisted
+        self.messages = messages
+        # False once older messages were trimmed off to respect the cap
+        self.complete = complete
+
+
+class SessionCache:
+    """
+    Cache LRU in-process untuk sesi yang sedang aktif: resep terpilih, system
+    prompt, ringkasan, dan pesan terbaru. Setiap penulisan lewat ContextService
+    langsung diterapkan ke cache (write-through), sehingga giliran chat
+    berikutnya tidak perlu membaca DB.
+
+    Cache ini per proses: dengan beberapa worker, aktifkan hanya jika request
+    satu sesi selalu diarahkan ke worker yang sama.
+    """
+    def __init__(self, max_entries: int, ttl_seconds: int, max_messages: int):
+        self.max_messages = max_messages
+        self._entries: TTLCache = TTLCache(maxsize=max_entries, ttl=ttl_seconds)
+        # Loads in progress; a write to the session drops its token so the
+        # (possibly older) DB snapshot is not cached afterwards
+        self._loading: Dict[str, object] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, session_id: str, history_limit: int) -> Optional[HotSession]:
+        """Entri sesi jika cukup untuk memuat history_limit pesan (0 = semua)."""
+        entry = self._entries.get(session_id)
+        if entry is not None and (
+            entry.complete or 0 < history_limit <= len(entry.messages)
+        ):
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return None
+
+    def begin_load(self, session_id: str) -> object:
+        token = object()
+        self._loading[session_id] = token
+        return token
+
+    def finish_load(self, session_id: str, token: object, entry: Optional[HotSession]):
+        """Menyimpan hasil load dari DB, kecuali sesi ditulis selama load berjalan."""
+        if self._loading.get(session_id) is not token:
+            return
+        del self._loading[session_id]
+        if entry is not None:
+            self._trim(entry)
+            self._entries[session_id] = entry
+
+    def put_new(self, session_id: str):
+        """Sesi baru: belum ada resep terpilih maupun pesan chat."""
+        self._touch(session_id)
+        self._entries[session_id] = HotSession(None, None, None, None, [], complete=True)
+
+    def set_recipe(self, session_id: str, recipe: Dict[str, Any], system_prompt: Optional[str]):
+        self._touch(session_id)
+        entry = self._entries.get(session_id)
+        if entry is not None:
+            entry.recipe = recipe
+            entry.system_prompt = system_prompt
+            self._entries[session_id] = entry
+
+    def add_messages(self, session_id: str, messages: List[Dict[str, Any]]):
+        self._touch(session_id)
+        entry = self._entries.get(session_id)
+        if entry is not None:
+            entry.messages.extend(messages)
+            self._trim(entry)
+            # Re-insert to mark the session as recently used
+            self._entries[session_id] = entry
+
+    def assign_ids(self, session_id: str, persisted: Iterable[Dict[str, Any]]):
+        """Mengisi id pesan yang baru ditulis ke DB (dipakai oleh ringkasan riwayat)."""
+        self._touch(session_id)
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return
+        ids = {(m["timestamp"], m["role"], m["content"]): m["id"] for m in persisted}
+        for m in entry.messages:
+            if m["id"] is None:
+                m["id"] = ids.get((m["timestamp"], m["role"], m["content"]))
+
+    def set_summary(self, session_id: str, summary: str, upto_message_id: int):
+        self._touch(session_id)
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return
+        if entry.summary_upto_message_id is not None and entry.summary_upto_message_id >= upto_message_id:
+            return
+        entry.history_summary = summary
+        entry.summary_upto_message_id = upto_message_id
+        entry.messages = [m for m in entry.messages if m["id"] is None or m["id"] > upto_message_id]
+
+    def invalidate(self, session_ids: Iterable[str]):
+        for session_id in session_ids:
+            self._touch(session_id)
+            self._entries.pop(session_id, None)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+    def _touch(self, session_id: str):
+        self._loading.pop(session_id, None)
+
+    def _trim(self, entry: HotSession):
+        if len(entry.messages) > self.max_messages:
+            entry.messages = entry.messages[-self.max_messages:]
+            entry.complete = False
+
+
+# Singleton instance (None when the hot-session cache is disabled)
+session_cache: Optional[SessionCache] = (
+    SessionCache(
+        max_entries=settings.session_cache_max_entries,
+        ttl_seconds=settings.session_cache_ttl_seconds,
+        max_messages=settings.session_cache_max_messages,
+    )
+    if settings.session_cache_enabled
+    else None
+)
@@ -0,0 +1,52 @@
+# app/services/singleflight.py
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+
+class _Call:
+    """Satu panggilan upstream yang sedang berjalan beserta jumlah penunggunya."""
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Menggabungkan panggilan async yang identik dan sedang berjalan bersamaan.
+    Pemanggil dengan key yang sama menunggu satu task upstream yang sama dan
+    menerima hasil (atau exception) yang sama.
+
+    Pembatalan satu pemanggil tidak membatalkan pemanggil lain; task upstream
+    hanya dibatalkan jika semua penunggunya sudah dibatalkan.
+    """
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _task: self._forget(key, call))
+
+        call.waiters += 1
+        try:
+            # shield() keeps a cancelled waiter from cancelling the shared task
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                # Last waiter gone: stop the upstream call and let new
+                # callers start a fresh one instead of joining a dying task.
+                self._forget(key, call)
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _forget(self, key: str, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]